@@ -1,5 +1,6 @@
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 import torch
+import generation
 
 if __name__ == '__main__':
     base_model = "meta-llama/Meta-Llama-3-8B-Instruct"
@@ -27,6 +28,8 @@ if __name__ == '__main__':
     model.load_adapter("Matej/FoodyLLM")
     model.config.use_cache = True
     model.eval()
+    # stop every answer at the end markers of the model
+    generate_kwargs = generation.generate_kwargs(tokenizer, model.generation_config)
 
     #Return the nutrient values for an example recipe
     system_prompt = ""
@@ -45,7 +48,7 @@ if __name__ == '__main__':
     tokenizer_input = [prompt]
 
     inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
-    generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
+    generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
     answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
     answers = [x.split('<|eot_id|>')[0].strip() for x in answers]
     print(answers[0])
@@ -68,7 +71,7 @@ if __name__ == '__main__':
     tokenizer_input = [prompt]
 
     inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
-    generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
+    generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
     answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
     answers = [x.split('<|eot_id|>')[0].strip() for x in answers]
     print(answers[0])
@@ -90,7 +93,7 @@ if __name__ == '__main__':
     tokenizer_input = [prompt]
 
     inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
-    generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
+    generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
     answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
     answers = [x.split('<|eot_id|>')[0].strip() for x in answers]
     print(answers[0])
@@ -111,7 +114,7 @@ if __name__ == '__main__':
     tokenizer_input = [prompt]
 
     inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
-    generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
+    generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
     answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
     answers = [x.split('<|eot_id|>')[0].strip() for x in answers]
     print(answers[0])
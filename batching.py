@@ -0,0 +1,97 @@
+import time
+
+# Batches of test set rows for generation. Instead of slicing the rows in file order into batches of a fixed size,
+# the rows are sorted by token length and grouped under a token budget, so short prompts are not padded to the
+# longest prompt of the file and more of them fit in a batch. The answers are put back in file order before the
+# results are written.
+
+
+def token_lengths(tokenizer, texts, max_length=1024):
+    return [len(ids) for ids in tokenizer(texts, truncation=True, max_length=max_length)['input_ids']]
+
+
+def token_budget_batches(lengths, max_tokens, reserved=0, max_rows=None):
+    """Row indexes from the longest row to the shortest, each batch costs rows * (longest row + reserved) tokens.
+
+    reserved are the tokens every row needs besides its prompt, e.g. max_new_tokens. A row longer than the budget
+    gets a batch of its own, and no batch has more than max_rows rows.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    longest = 0
+    for i in order:
+        if batch and ((len(batch) + 1) * (max(longest, lengths[i]) + reserved) > max_tokens
+                      or (max_rows is not None and len(batch) >= max_rows)):
+            batches.append(batch)
+            batch = []
+            longest = 0
+        batch.append(i)
+        longest = max(longest, lengths[i])
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def chain_parents(instructions):
+    """For every row the row whose answer it continues, or None for first turns.
+
+    A row with </div> continues the last row before it without </div>, as the NER and NEL test sets are written.
+    """
+    parents = []
+    last = None
+    for i, instruction in enumerate(instructions):
+        if '</div>' in instruction:
+            parents.append(last)
+        else:
+            parents.append(None)
+            last = i
+    return parents
+
+
+def dependency_waves(parents):
+    """Rows of the first turns, then rows of the turns continuing them, whose prompts need the first wave's answers."""
+    return [[i for i, parent in enumerate(parents) if parent is None],
+            [i for i, parent in enumerate(parents) if parent is not None]]
+
+
+def wave_batches(rows, lengths, max_tokens, reserved=0, max_rows=None):
+    """token_budget_batches of the rows of a wave, lengths[j] is the prompt length of rows[j]."""
+    return [[rows[j] for j in batch] for batch in token_budget_batches(lengths, max_tokens, reserved, max_rows)]
+
+
+def restore_order(batches, rows):
+    """The rows produced batch by batch (one per index of batches, in the same order) sorted back to file order."""
+    indexes = [i for batch in batches for i in batch]
+    ordered = [None] * len(indexes)
+    for i, row in zip(indexes, rows):
+        ordered[i] = row
+    return ordered
+
+
+class Throughput:
+    """Generated tokens per second of one test set."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.rows = 0
+        self.capped = 0
+        self.start = time.perf_counter()
+
+    def add(self, generated_ids, prompt_length, eos_token_id):
+        """Counts the new tokens of every row up to and including its first eos token, the padding after it is not
+        counted whatever the pad token is. Rows without an eos token ran until max_new_tokens, they are counted as
+        capped."""
+        eos = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+        for row in generated_ids[:, prompt_length:].tolist():
+            length = next((i + 1 for i, token in enumerate(row) if token in eos), None)
+            if length is None:
+                length = len(row)
+                self.capped += 1
+            self.tokens += length
+            self.rows += 1
+
+    def report(self, name):
+        elapsed = time.perf_counter() - self.start
+        print(f'{name}: {self.tokens} tokens in {elapsed:.1f} s, {self.tokens / max(elapsed, 1e-9):.1f} tokens/s, '
+              f'{self.capped} of {self.rows} rows stopped at max_new_tokens')
@@ -12,16 +12,22 @@ from aiolimiter import AsyncLimiter
 import os
 import editdistance
 import pandas as pd
+import sys
+
+#the shared modules are in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import split_store
 
 
 api_rate_limiter = AsyncLimiter(max_rate=10, time_period=1)
 
 MAX_RETRIES = 3
 
+
 #this function assumes that the train and test set data have been created using the preprocess.py function
 def get_train_path(test_set_folder, test_set_file):
     train_set_folder = test_set_folder.replace('test', 'train')
-    all_files = os.listdir(train_set_folder)
+    all_files = [f for f in os.listdir(train_set_folder) if f.endswith('.tsv')]
     min_dist = 1000000
     target_file = ""
     for f in all_files:
@@ -30,7 +36,7 @@ def get_train_path(test_set_folder, test_set_file):
             target_file = f
             min_dist = dist
     target_file_path = os.path.join(train_set_folder, target_file)
-    df = pd.read_csv(target_file_path, sep='\t')
+    df = split_store.read_table(target_file_path)
     return df
 
 
@@ -134,7 +140,7 @@ if __name__ == '__main__':
             print('Fold: ', fold)
             test_folder = os.path.join(TEST_SET_PATH, fold)
 
-            all_datasets = os.listdir(test_folder)
+            all_datasets = [f for f in os.listdir(test_folder) if f.endswith('.tsv')]
             for td in all_datasets:
                 all_data = []
                 if '_combined.tsv' not in td:
@@ -142,7 +148,7 @@ if __name__ == '__main__':
                     df_sample_dataset = get_train_path(test_folder, td)
                     #if td == 'nel_bootstrap_samples_fcd_mistral_hansard.tsv':
                     if 'ner' not in td:
-                        df = pd.read_csv(os.path.join(test_folder, td), encoding='utf8', sep='\t')
+                        df = split_store.read_table(os.path.join(test_folder, td))
                         if not os.path.exists("results/" + setting + '_gemini_2.0_flash/'):
                             os.makedirs("results/" + setting + '_gemini_2.0_flash/')
                         output_path = "results/" + setting + '_gemini_2.0_flash/' + td.split('.')[0] + '_' + fold + ".tsv"
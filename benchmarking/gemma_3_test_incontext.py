@@ -2,11 +2,19 @@ import pandas as pd
 from transformers import AutoProcessor, Gemma3ForConditionalGeneration
 import os, torch
 import editdistance
+import sys
+
+#the shared modules are in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import split_store
+import batching
+import generation
+
 
 #this function assumes that the train and test set data have been created using the preprocess.py function
 def get_train_path(test_set_folder, test_set_file):
     train_set_folder = test_set_folder.replace('test', 'train')
-    all_files = os.listdir(train_set_folder)
+    all_files = [f for f in os.listdir(train_set_folder) if f.endswith('.tsv')]
     min_dist = 1000000
     target_file = ""
     for f in all_files:
@@ -15,7 +23,7 @@ def get_train_path(test_set_folder, test_set_file):
             target_file = f
             min_dist = dist
     target_file_path = os.path.join(train_set_folder, target_file)
-    df = pd.read_csv(target_file_path, sep='\t')
+    df = split_store.read_table(target_file_path)
     return df
 
 def add_examples(df_sample_dataset, user_prompt, setting, div):
@@ -53,8 +61,13 @@ if __name__ == '__main__':
     model_id = "google/gemma-3-4b-it"
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     settings = ['zero-shot', 'one-shot', 'five-shot']
+    # caps the new tokens of the answers by the longest answer of the train set, which shortens verbose answers and
+    # changes the scores compared with the published results
+    cap_new_tokens = False
     folds = ['split_0', 'split_1', 'split_2', 'split_3', 'split_4']
     test_batch = 24
+    # no prefix caching here (see prefix_cache.py): Gemma 3 keeps a hybrid cache with sliding window layers, which is
+    # not a DynamicCache that can be copied and repeated for every row of a batch
     for setting in settings:
         for fold in folds:
             # Loading a dataset
@@ -68,75 +81,90 @@ if __name__ == '__main__':
 
             processor = AutoProcessor.from_pretrained(model_id)
 
-            all_datasets = os.listdir(test_folder)
+            all_datasets = [f for f in os.listdir(test_folder) if f.endswith('.tsv')]
             for td in all_datasets:
                 all_data = []
                 if '_combined.tsv' not in td:
                     print('Testing on ', td)
                     df_sample_dataset = get_train_path(test_folder, td)
-                    if 'ner' not in td:
-                        current_batch = test_batch
-                    else:
-                        current_batch = 1
-                    df = pd.read_csv(os.path.join(test_folder, td), encoding='utf8', sep='\t')
-                    prev_answer = ""
-                    for i in range(0, len(df), current_batch):
-                        if i % (current_batch * 10) == 0:
-                            print('Generating example', i)
-                        examples = df[i:i + current_batch]
-                        tokenizer_input = []
-                        true_outputs = []
-                        for true_output in examples['output']:
-                            true_outputs.append(true_output)
-                        original_prompts = []
-                        true_prompts = []
-                        for user_prompt in examples['instruction']:
-                            original_prompts.append(user_prompt)
-                            system_prompt = ''
-                            get_answer = False
-                            if not '</div>' in user_prompt:
-                                div = False
-                                if setting in ['one-shot', 'five-shot']:
-                                    user_prompt = add_examples(df_sample_dataset, user_prompt, setting, div)
-                                get_answer = True
-                            else:
-                                div = True
-                                _, question = user_prompt.split("</div>")
-                                if setting in ['one-shot', 'five-shot']:
-                                    user_prompt = add_examples(df_sample_dataset, prev_answer.strip() + " " + question.strip(), setting, div)
-
-                            messages = [
-                                {
-                                    "role": "system",
-                                    "content": [{"type": "text", "text": f"{system_prompt}".strip()}]
-                                },
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": f"{user_prompt}".strip()}
-                                    ]
-                                }
-                            ]
-
-                            prompt = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                            tokenizer_input.append(prompt)
-
-                        inputs = processor(text=tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=2048).to(device)
-                        with torch.inference_mode():
-                            generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=False)
-                        answers = processor.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-                        answers = [(" ".join((x.split('</s>')[0].split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0].split())).strip() for x in answers]
-                        if get_answer:
-                            prev_answer = answers[0]
-
-                        tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
-
-                        original_prompts = [x.strip() for x in original_prompts]
-                        batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
-                        all_data.extend(batched_examples)
+                    current_batch = test_batch
+                    df = split_store.read_table(os.path.join(test_folder, td))
+                    # base models answer in their own words, they get MAX_NEW_TOKENS as in the published runs, or with
+                    # cap_new_tokens three times the longest answer of the train set
+                    new_tokens = generation.max_new_tokens(processor.tokenizer, df_sample_dataset['output'], margin=3) if cap_new_tokens \
+                        else generation.MAX_NEW_TOKENS
+                    generate_kwargs = generation.generate_kwargs(processor.tokenizer, model.generation_config, new_tokens)
+                    print('max_new_tokens', generate_kwargs['max_new_tokens'])
+                    # the prompt a row is generated from, with the answer of the first turn it continues
+                    def format_prompt(user_prompt, prev_answer):
+                        system_prompt = ''
+                        if not '</div>' in user_prompt:
+                            div = False
+                            if setting in ['one-shot', 'five-shot']:
+                                user_prompt = add_examples(df_sample_dataset, user_prompt, setting, div)
+                        else:
+                            div = True
+                            _, question = user_prompt.split("</div>")
+                            if setting in ['one-shot', 'five-shot']:
+                                user_prompt = add_examples(df_sample_dataset, prev_answer.strip() + " " + question.strip(), setting, div)
+
+                        messages = [
+                            {
+                                "role": "system",
+                                "content": [{"type": "text", "text": f"{system_prompt}".strip()}]
+                            },
+                            {
+                                "role": "user",
+                                "content": [
+                                    {"type": "text", "text": f"{user_prompt}".strip()}
+                                ]
+                            }
+                        ]
+
+                        prompt = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                        return prompt
+
+                    # the first turns of all documents are generated in one wave and the turns continuing their answers (</div>)
+                    # in a second one. The prompts of a wave are built before batching, so the rows are sorted by the token length
+                    # of the prompt they are generated from and batched under a token budget with the same worst case as
+                    # 2048 token prompts in batches of current_batch
+                    parents = batching.chain_parents(df['instruction'].tolist())
+                    batches = []
+                    answers_by_row = {}
+                    throughput = batching.Throughput()
+                    for wave in batching.dependency_waves(parents):
+                        prompts = {row: format_prompt(df['instruction'].iloc[row], answers_by_row.get(parents[row], "")) for row in wave}
+                        lengths = batching.token_lengths(processor.tokenizer, [prompts[row] for row in wave], max_length=2048)
+                        wave_batches = batching.wave_batches(wave, lengths, current_batch * (2048 + 1024), reserved=generate_kwargs['max_new_tokens'],
+                                                             max_rows=2 * current_batch)
+                        batches += wave_batches
+                        for n, batch in enumerate(wave_batches):
+                            if n % 10 == 0:
+                                print('Generating batch', n, 'of', len(wave_batches))
+                            examples = df.iloc[batch]
+                            tokenizer_input = [prompts[row] for row in batch]
+                            true_outputs = examples['output'].tolist()
+                            original_prompts = examples['instruction'].tolist()
+
+                            inputs = processor(text=tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=2048).to(device)
+                            with torch.inference_mode():
+                                generated_ids = model.generate(**inputs, do_sample=False, **generate_kwargs)
+                            throughput.add(generated_ids, inputs['input_ids'].shape[1], generate_kwargs['eos_token_id'])
+                            answers = processor.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+                            answers = [(" ".join((x.split('</s>')[0].split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0].split())).strip() for x in answers]
+                            answers_by_row.update(zip(batch, answers))
+
+                            tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
+
+                            original_prompts = [x.strip() for x in original_prompts]
+                            batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
+                            all_data.extend(batched_examples)
 
                     suffix = '_gemma-3-4b-it/'
 
+                    # back to the order of the test set
+                    all_data = batching.restore_order(batches, all_data)
+                    throughput.report(td)
                     df = pd.DataFrame(all_data, columns=['Original prompt', 'True prompt', 'Answer', 'True'])
                     if not os.path.exists("results/" + setting + suffix):
                         os.makedirs("results/" + setting + suffix)
@@ -0,0 +1,223 @@
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from src.Entities import Recipe, RecipeTable
+from src.QuantityParser import QuantityParser
+from src.RecipeReader import RecipeReader
+from src.RecipeSampling import RecipeIngrNutritionSequenceGenerator
+from src.SamplingState import SamplingState
+from src.SimilarityIndex import JaccardIndex
+
+
+class SyntheticRecipes:
+    units = ['cup', 'tablespoon', 'teaspoon', 'g', 'ounce', 'pinch']
+    quantities = ['1', '2', '3', '1/2', '1 1/2', '3/4', '1/4', '2 1/2', '0.5', '1-2', '2 to 3']
+    lights = ['green', 'orange', 'red']
+
+    @staticmethod
+    def ingredients(count: int, rng: random.Random, vocabulary: int = 50000) -> list:
+        # a few very common ingredients and a long (log-uniform) tail, roughly like Recipe1M+
+        ingredients = []
+        for _ in range(count):
+            if rng.random() < 0.2:
+                ingredients.append(f'common ingredient {rng.randint(0, 20)}')
+            else:
+                ingredients.append(f'ingredient {int(vocabulary ** rng.random())}')
+        return ingredients
+
+    @classmethod
+    def raw(cls, count: int, seed: int = 0) -> list:
+        rng = random.Random(seed)
+        instances = []
+        for i in range(count):
+            ingredients = cls.ingredients(rng.randint(3, 12), rng)
+            instances.append({
+                'id': f'{i:010x}',
+                'partition': 'train',
+                'title': f'recipe {rng.randint(0, count)}',
+                'fsa_lights_per100g': {nutrient: rng.choice(cls.lights)
+                                       for nutrient in ['fat', 'salt', 'saturates', 'sugars']},
+                'nutr_values_per100g': {nutrient: rng.random() * 100
+                                        for nutrient in ['energy', 'fat', 'protein', 'salt', 'saturates', 'sugars']},
+                'ingredients': [{'text': ingredient} for ingredient in ingredients],
+                'quantity': [{'text': rng.choice(cls.quantities)} for _ in ingredients],
+                'unit': [{'text': rng.choice(cls.units)} for _ in ingredients],
+                'weight_per_ingr': [rng.random() * 100 for _ in ingredients],
+                'instructions': [{'text': 'Mix all ingredients.'}, {'text': 'Bake for 20 minutes.'}],
+                'nutr_per_ingredient': [{nutrient: rng.random() * 10
+                                         for nutrient in ['fat', 'nrg', 'pro', 'sat', 'sod', 'sug']}
+                                        for _ in ingredients]
+            })
+        return instances
+
+
+class SamplingStateBenchmark:
+    @staticmethod
+    def candidates(count: int, rng: random.Random) -> list:
+        candidates = []
+        for i in range(count):
+            ingredients = sorted(ingredient.lower() for ingredient in SyntheticRecipes.ingredients(
+                rng.randint(3, 12), rng))
+            candidates.append([f'{rng.getrandbits(40):010x}', f'recipe {i}', ingredients])
+        return candidates
+
+    @staticmethod
+    def time_per_candidate(check, candidates: list) -> float:
+        start = time.perf_counter()
+        for candidate in candidates:
+            check(candidate)
+        return (time.perf_counter() - start) / len(candidates) * 1e6
+
+    @classmethod
+    def run(cls, sizes=(1000, 10000, 100000), probes: int = 2000, list_probes: int = 100,
+            max_jaccard: float = 0.75, seed: int = 0):
+        rng = random.Random(seed)
+        sampled = cls.candidates(max(sizes), rng)
+        probes_ = cls.candidates(probes, rng)
+        token_frequency = JaccardIndex.count_tokens(ingredients for _, _, ingredients in sampled)
+
+        print('sample size\tstate (us/candidate)\tlists, without jaccard (us/candidate)')
+        for size in sizes:
+            state = SamplingState(max_jaccard, token_frequency)
+            ids = []
+            titles = []
+            for recipe_id, title, ingredients in sampled[:size]:
+                state.add(recipe_id, title, ingredients)
+                ids.append(recipe_id)
+                titles.append(title)
+
+            state_time = cls.time_per_candidate(
+                lambda c: state.contains_id(c[0]) or state.contains_title(c[1]) or state.too_similar(c[2]),
+                probes_)
+            list_time = cls.time_per_candidate(lambda c: c[0] in ids or c[1] in titles, probes_[:list_probes])
+            print(f'{size}\t{state_time:.2f}\t{list_time:.2f}')
+
+
+class ReaderMemoryBenchmark:
+    @staticmethod
+    def index(recipes) -> dict:
+        index = dict()
+        for recipe in recipes:
+            for ingredient, unit in zip(recipe.ingredients, recipe.ingredient_unit):
+                index.setdefault(f'{unit} {ingredient}', []).append(recipe)
+        return index
+
+    @staticmethod
+    def json_load(data_file: str):
+        with open(data_file, encoding="utf-8") as f:
+            instances = json.load(f)
+            return [Recipe(instance) for instance in instances]
+
+    @staticmethod
+    def peak_memory(build) -> [float, float]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return [peak / 2 ** 20, elapsed]
+
+    @classmethod
+    def run(cls, data_file: str = None, count: int = 50000):
+        temporary = None
+        if data_file is None:
+            temporary = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8')
+            json.dump(SyntheticRecipes.raw(count), temporary)
+            temporary.close()
+            data_file = temporary.name
+
+        print(f'input file: {os.path.getsize(data_file) / 2 ** 20:.1f} MiB')
+        peak, elapsed = cls.peak_memory(lambda: cls.index(cls.json_load(data_file)))
+        print(f'json.load\tpeak {peak:.1f} MiB\t{elapsed:.1f} s')
+        peak, elapsed = cls.peak_memory(lambda: cls.index(RecipeReader().read(data_file)))
+        print(f'RecipeReader\tpeak {peak:.1f} MiB\t{elapsed:.1f} s')
+
+        if temporary is not None:
+            os.remove(data_file)
+
+
+class RenderingBenchmark:
+    @staticmethod
+    def generate_per_recipe(generator, sample: list) -> dict:
+        # the former RecipeIngrNutritionSequenceGenerator.generate, one template draw and += per ingredient
+        questions = []
+        answers = []
+        for i, recipe, _, _ in sample:
+            question = ''
+            for ingredient, quantity, unit in zip(recipe.ingredients, recipe.ingredient_quantity,
+                                                  recipe.ingredient_unit):
+                question += f'{quantity} {unit} {ingredient}, '
+            question = question[:-2]
+
+            answer = (f'energy - {recipe.energy_value:.2f}, fat - {recipe.fat_value:.2f}, '
+                      f'protein - {recipe.protein_value:.2f}, salt - {recipe.salt_value:.2f}, '
+                      f'saturates - {recipe.saturates_value:.2f}, sugars - {recipe.sugars_value:.2f}')
+
+            questions.append(
+                f'{generator.start} '
+                f'{generator.recipe_question_prompts[
+                    generator.generate_random_number(0, len(generator.recipe_question_prompts) - 1)]}'
+                f' {question.strip()} {generator.end}')
+            answers.append(
+                f'{generator.recipe_answer_prompts[
+                    generator.generate_random_number(0, len(generator.recipe_answer_prompts) - 1)]}'
+                f' {answer}')
+        return {'questions': questions, 'answers': answers}
+
+    @classmethod
+    def run(cls, count: int = 200000, seed: int = 0):
+        table = RecipeTable()
+        for instance in SyntheticRecipes.raw(count, seed):
+            table.append(Recipe(instance))
+        table.freeze()
+        sample = [[recipe.id_, recipe, recipe.title, ''] for recipe in table]
+
+        results = []
+        for name, generate in [['per recipe', lambda g: cls.generate_per_recipe(g, sample)],
+                               ['batched', lambda g: g.generate(sample, [])]]:
+            generator = RecipeIngrNutritionSequenceGenerator(random_seed=seed, max_count=20, max_jaccard=0.75)
+            start = time.perf_counter()
+            results.append(generate(generator))
+            elapsed = time.perf_counter() - start
+            print(f'{name}\t{count / elapsed:.0f} rows/s')
+        print('identical output:', results[0] == results[1])
+
+
+class QuantityParserBenchmark:
+    @staticmethod
+    def quantities(data_file: str = None, count: int = 50000) -> list:
+        # the quantity strings in dataset order, so the distribution is the real one when a file is given
+        instances = RecipeReader().read_instances(data_file) if data_file is not None \
+            else SyntheticRecipes.raw(count)
+        return [quantity['text'] for instance in instances for quantity in instance['quantity']]
+
+    @staticmethod
+    def time_per_call(parse, quantities: list) -> [list, float]:
+        start = time.perf_counter()
+        values = [parse(quantity) for quantity in quantities]
+        return [values, (time.perf_counter() - start) / len(quantities) * 1e9]
+
+    @classmethod
+    def run(cls, data_file: str = None, count: int = 50000):
+        quantities = cls.quantities(data_file, count)
+        values, convert_time = cls.time_per_call(QuantityParser.convert, quantities)
+        parser = QuantityParser()
+        parsed, parser_time = cls.time_per_call(parser.parse, quantities)
+
+        print(f'{len(quantities)} quantities, {len(set(quantities))} distinct')
+        print(f'Fraction/try\t{convert_time:.0f} ns/quantity')
+        print(f'QuantityParser\t{parser_time:.0f} ns/quantity')
+        print('identical values:', [repr(value) for value in values] == [repr(value) for value in parsed])
+        print(parser.stats())
+
+
+if __name__ == '__main__':
+    SamplingStateBenchmark.run()
+    ReaderMemoryBenchmark.run()
+    RenderingBenchmark.run()
+    QuantityParserBenchmark.run()
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import pickle
+
+from src.RecipeCache import RecipeCache
+
+
+class Manifest:
+    """Row count and content hash of one output file, with the parameters that produced it.
+
+    Saved next to the output as <file>.manifest.json once the file is complete, so a rerun with the same parameters
+    can skip outputs that are already there and unchanged.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.path = output_file + '.manifest.json'
+
+    def read(self):
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def matches(self, parameters: dict) -> bool:
+        manifest = self.read()
+        return manifest is not None and manifest['parameters'] == parameters \
+            and os.path.isfile(self.output_file) and RecipeCache.file_hash(self.output_file) == manifest['sha256']
+
+    def write(self, parameters: dict, rows: int):
+        manifest = {'file': os.path.basename(self.output_file), 'rows': rows,
+                    'sha256': RecipeCache.file_hash(self.output_file), 'parameters': parameters}
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Checkpoint:
+    """Pickled intermediate state of one generation job, named after the hash of its parameters.
+
+    A changed input file or changed parameters give a different name, so stale state is never resumed.
+    """
+
+    def __init__(self, directory: str, parameters: dict):
+        digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+        self.path = os.path.join(directory, f'{digest}.pickle')
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, state: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def write_output(writer, output_file: str, parameters: dict, questions, answers, **options) -> int:
+    """Write through a temporary file and record the manifest, an interrupted write never looks complete."""
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    rows = writer.write(output_file + '.tmp', False, questions, answers, **options)
+    os.replace(output_file + '.tmp', output_file)
+    Manifest(output_file).write(parameters, rows)
+    return rows
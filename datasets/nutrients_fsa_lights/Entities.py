@@ -1,4 +1,17 @@
+import copy
+from array import array
+
+import numpy as np
+
+
 class Recipe:
+    __slots__ = ['id_', 'partition', 'title',
+                 'fat_fsa', 'salt_fsa', 'saturates_fsa', 'sugars_fsa',
+                 'energy_value', 'fat_value', 'protein_value', 'salt_value', 'saturates_value', 'sugars_value',
+                 'ingredients', 'ingredient_quantity', 'ingredient_unit', 'ingredient_weight', 'instructions',
+                 'ingredient_fat', 'ingredient_nrg', 'ingredient_pro', 'ingredient_sat', 'ingredient_sod',
+                 'ingredient_sug']
+
     def __init__(self, raw_info: dict):
         self.id_ = self.parse_attribute(raw_info, 'id')
         self.partition = self.parse_attribute(raw_info, 'partition')
@@ -76,3 +89,118 @@ class Recipe:
                 values['salt'],
                 values['saturates'],
                 values['sugars']]
+
+
+class RecipeRow:
+    """Read-only view of one recipe in a RecipeTable, with the same attributes as Recipe."""
+    __slots__ = ['table', 'row']
+
+    def __init__(self, table, row: int):
+        self.table = table
+        self.row = row
+
+    def __getattr__(self, name):
+        return self.table.get(self.row, name)
+
+
+class RecipeTable:
+    """Columnar store of recipes.
+
+    Per ingredient nutrients and weights are kept in contiguous float64 arrays and the per ingredient strings in
+    flat lists, all addressed through one offset index. Recipes are appended while reading and the columns are
+    converted to NumPy arrays by freeze(). The few recipes whose per ingredient lists have different lengths or null
+    values keep their lists in ragged instead, with no rows in the ingredient columns, so they read back unchanged.
+    """
+    recipe_text_columns = ['id_', 'partition', 'title', 'fat_fsa', 'salt_fsa', 'saturates_fsa', 'sugars_fsa']
+    recipe_value_columns = ['energy_value', 'fat_value', 'protein_value', 'salt_value', 'saturates_value',
+                            'sugars_value']
+    ingredient_text_columns = ['ingredients', 'ingredient_quantity', 'ingredient_unit']
+    ingredient_value_columns = ['ingredient_weight', 'ingredient_fat', 'ingredient_nrg', 'ingredient_pro',
+                                'ingredient_sat', 'ingredient_sod', 'ingredient_sug']
+
+    def __init__(self):
+        self.columns = dict()
+        for column in self.recipe_text_columns + self.ingredient_text_columns + ['instructions']:
+            self.columns[column] = []
+        for column in self.recipe_value_columns + self.ingredient_value_columns:
+            self.columns[column] = array('d')
+        # recipe i owns the ingredients offsets[i]:offsets[i + 1] and instructions
+        # instruction_offsets[i]:instruction_offsets[i + 1]
+        self.offsets = array('q', [0])
+        self.instruction_offsets = array('q', [0])
+        # recipe -> per ingredient lists, for the recipes with lists of different lengths or null values
+        self.ragged = dict()
+        self.strings = dict()
+        self.frozen = False
+
+    def intern(self, text: str) -> str:
+        # ingredient names, quantities and units repeat a lot, keep one string object per distinct value
+        return self.strings.setdefault(text, text)
+
+    def packable(self, recipe: Recipe) -> bool:
+        """Whether the per ingredient lists of the recipe have the same length and no null values (float columns)."""
+        count = len(recipe.ingredients)
+        for column in self.ingredient_text_columns:
+            if len(getattr(recipe, column)) != count:
+                return False
+        for column in self.ingredient_value_columns:
+            values = getattr(recipe, column)
+            if values is None or len(values) != count or any(value is None for value in values):
+                return False
+        return True
+
+    def append(self, recipe: Recipe):
+        if self.frozen:
+            raise ValueError('Cannot append to a frozen RecipeTable')
+        for column in self.recipe_text_columns:
+            self.columns[column].append(getattr(recipe, column))
+        for column in self.recipe_value_columns:
+            self.columns[column].append(getattr(recipe, column))
+
+        count = len(recipe.ingredients)
+        if not self.packable(recipe):
+            self.ragged[len(self)] = {column: copy.copy(getattr(recipe, column))
+                                      for column in self.ingredient_text_columns + self.ingredient_value_columns}
+            count = 0
+        else:
+            for column in self.ingredient_text_columns:
+                self.columns[column].extend(self.intern(text) for text in getattr(recipe, column))
+            for column in self.ingredient_value_columns:
+                self.columns[column].extend(getattr(recipe, column))
+        self.offsets.append(self.offsets[-1] + count)
+
+        self.columns['instructions'].extend(recipe.instructions)
+        self.instruction_offsets.append(self.instruction_offsets[-1] + len(recipe.instructions))
+
+    def freeze(self):
+        for column in self.recipe_value_columns + self.ingredient_value_columns:
+            self.columns[column] = np.array(self.columns[column], dtype=np.float64)
+        self.offsets = np.array(self.offsets, dtype=np.int64)
+        self.instruction_offsets = np.array(self.instruction_offsets, dtype=np.int64)
+        self.strings = dict()
+        self.frozen = True
+
+    def get(self, row: int, name: str):
+        if name in self.recipe_text_columns:
+            return self.columns[name][row]
+        elif name in self.recipe_value_columns:
+            return float(self.columns[name][row])
+        elif row in self.ragged and name in self.ragged[row]:
+            return copy.copy(self.ragged[row][name])
+        elif name in self.ingredient_text_columns:
+            return self.columns[name][self.offsets[row]:self.offsets[row + 1]]
+        elif name in self.ingredient_value_columns:
+            return self.columns[name][self.offsets[row]:self.offsets[row + 1]].tolist()
+        elif name == 'instructions':
+            return self.columns[name][self.instruction_offsets[row]:self.instruction_offsets[row + 1]]
+        raise AttributeError(name)
+
+    def __getitem__(self, row: int) -> RecipeRow:
+        return RecipeRow(self, int(row))
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield RecipeRow(self, row)
+
+    def __len__(self):
+        return len(self.offsets) - 1
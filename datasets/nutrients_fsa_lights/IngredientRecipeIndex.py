@@ -0,0 +1,65 @@
+from array import array
+
+
+class IngredientRecipeIndex:
+    """Append-only index from 'unit ingredient' keys to the recipes that use them.
+
+    Recipes are kept once in a single store, every key only holds the store positions of its recipes
+    (and the position of the ingredient inside the recipe) in compact integer arrays.
+    """
+
+    def __init__(self, store=None):
+        self.recipes = store if store is not None else []
+        self.recipe_ids = dict()
+        self.ingredient_positions = dict()
+
+    @staticmethod
+    def key(ingredient: str, unit: str) -> str:
+        return f'{unit} {ingredient}'
+
+    @staticmethod
+    def ingredient_count(recipe) -> int:
+        # ingredients with a quantity, unit and nutrients, as when zipping the per ingredient lists
+        return min(len(recipe.ingredients), len(recipe.ingredient_quantity), len(recipe.ingredient_unit),
+                   len(recipe.ingredient_fat), len(recipe.ingredient_nrg), len(recipe.ingredient_pro),
+                   len(recipe.ingredient_sat), len(recipe.ingredient_sod), len(recipe.ingredient_sug))
+
+    def add(self, recipe, keep=None) -> int:
+        """Store the recipe and index every ingredient for which keep(recipe, position) holds (all by default)."""
+        recipe_id = len(self.recipes)
+        self.recipes.append(recipe)
+        ingredients = recipe.ingredients
+        units = recipe.ingredient_unit
+        for position in range(self.ingredient_count(recipe)):
+            if keep is not None and not keep(recipe, position):
+                continue
+            key = self.key(ingredients[position], units[position])
+            if key not in self.recipe_ids:
+                self.recipe_ids[key] = array('I')
+                self.ingredient_positions[key] = array('I')
+            self.recipe_ids[key].append(recipe_id)
+            self.ingredient_positions[key].append(position)
+        return recipe_id
+
+    def count(self) -> dict:
+        return {key: len(recipe_ids) for key, recipe_ids in self.recipe_ids.items()}
+
+    def keys_by_count(self, reverse: bool = False) -> list:
+        count = self.count()
+        return sorted(count, key=count.get, reverse=reverse)
+
+    def get(self, key: str) -> list:
+        return [self.recipes[recipe_id] for recipe_id in self.recipe_ids[key]]
+
+    def occurrences(self, key: str):
+        for recipe_id, position in zip(self.recipe_ids[key], self.ingredient_positions[key]):
+            yield self.recipes[recipe_id], position
+
+    def keys(self):
+        return self.recipe_ids.keys()
+
+    def __contains__(self, key: str):
+        return key in self.recipe_ids
+
+    def __len__(self):
+        return len(self.recipe_ids)
@@ -1,10 +1,14 @@
-import json
+import heapq
 import os
 import random
 from abc import ABC, abstractmethod
-from fractions import Fraction
 
-from src.Entities import Recipe
+from src.Checkpoints import Checkpoint, Manifest, write_output
+from src.Entities import RecipeTable
+from src.IngredientRecipeIndex import IngredientRecipeIndex
+from src.QuantityParser import QuantityParser
+from src.RecipeCache import RecipeCache
+from src.RecipeReader import RecipeReader
 from src.Writer import Writer
 
 
@@ -260,119 +264,110 @@ class SequenceGenerator(ABC):
         "These nutrient values noted are:"
     ]
 
-    def __init__(self):
-        random.seed(42)
+    def __init__(self, random_seed: int = 42):
+        self.random = random.Random(random_seed)
+        self.random_seed = random_seed
 
     @abstractmethod
     def generate_sequences(self, data_file: str) -> dict:
         raise NotImplementedError()
 
-    @staticmethod
-    def generate_random_number(start: int, end: int) -> int:
-        number = random.randint(start, end)
+    def generate_random_number(self, start: int, end: int) -> int:
+        number = self.random.randint(start, end)
         return number
 
 
 class IngredientQuantityNutrientValueSequenceGenerator(SequenceGenerator):
-    @staticmethod
-    def convert(q: str):
-        try:
-            if '-' in q or 'to' in q:
-                return None
-            elif '/' in q:
-                s = float(sum(Fraction(s) for s in q.split()))
-                return s
-            else:
-                return float(q)
-        except Exception:
-            return None
+    quantities_per_ingredient = 6
 
-    def generate_sequences(self, data_file: str) -> dict:
-        questions = []
-        questions_test = []
-        answers = []
-        answers_test = []
+    def __init__(self, random_seed: int = 42):
+        super().__init__(random_seed)
+        # the same few quantity strings repeat millions of times, each distinct one is parsed once
+        self.quantity_parser = QuantityParser()
+
+    def convert(self, q: str):
+        return self.quantity_parser.parse(q)
 
-        all = []
-        skipped = []
-        candidates = []
-        in_dictionary = []
-
-        ingredient_count = dict()
-        ingredient_nutritional = dict()
-
-        with open(data_file, encoding="utf-8") as f:
-            instances = json.load(f)
-            for i, instance in enumerate(instances):
-                recipe = Recipe(instance)
-
-                for ingredient, quant, unit, fat, ngr, pro, sat, sod, sug in zip(recipe.ingredients,
-                                                                                 recipe.ingredient_quantity,
-                                                                                 recipe.ingredient_unit,
-                                                                                 recipe.ingredient_fat,
-                                                                                 recipe.ingredient_nrg,
-                                                                                 recipe.ingredient_pro,
-                                                                                 recipe.ingredient_sat,
-                                                                                 recipe.ingredient_sod,
-                                                                                 recipe.ingredient_sug):
-                    all.append([i, ingredient, unit, quant])
-
-                    # try to convert each unit to number
-                    quantity = self.convert(quant)
-                    if quantity is None:
-                        skipped.append([i, ingredient, unit, quant])
-                        continue
-
-                    candidates.append([i, ingredient, unit, quant])
-
-                    ingredient_unit = f'{unit} {ingredient}'
-                    answer = (f'energy - {ngr:.2f}, fat - {fat:.2f}, protein - {pro:.2f}, '
-                              f'salt - {sod:.2f}, saturates - {sat:.2f}, sugars - {sug:.2f}')
-                    if ingredient_unit not in ingredient_count.keys():
-                        in_dictionary.append([i, ingredient, unit, quant])
-                        ingredient_count[ingredient_unit] = 1
-                        quantities = dict()
-                        quantities[quantity] = [quant, answer]
-                        ingredient_nutritional[ingredient_unit] = quantities.copy()
-                    else:
-                        ingredient_count[ingredient_unit] = int(ingredient_count[ingredient_unit]) + 1
-                        quantities = ingredient_nutritional[ingredient_unit].copy()
-                        if quantity not in quantities.keys():
-                            in_dictionary.append([i, ingredient, unit, quant])
-                            quantities[quantity] = [quant, answer]
-                            ingredient_nutritional[ingredient_unit] = quantities.copy()
+    def smallest_quantities(self, index: IngredientRecipeIndex, key: str, count) -> list:
+        """[quantity, [quantity text, answer]] of the count smallest distinct quantities of an ingredient (all if None).
+
+        The first occurrence of every quantity wins, answers are only formatted for the selected quantities.
+        """
+        first = dict()
+        for recipe, position in index.occurrences(key):
+            quantity = self.convert(recipe.ingredient_quantity[position])
+            if quantity not in first:
+                first[quantity] = [recipe, position]
+
+        if count is None or any(quantity != quantity for quantity in first):
+            # nsmallest matches sorted()[:count] only for a total order, NaN quantities keep the plain sort
+            quantities = sorted(first, key=float)[:count]
+        else:
+            quantities = heapq.nsmallest(count, first, key=float)
+
+        selected = []
+        for quantity in quantities:
+            recipe, position = first[quantity]
+            answer = (f'energy - {recipe.ingredient_nrg[position]:.2f}, '
+                      f'fat - {recipe.ingredient_fat[position]:.2f}, '
+                      f'protein - {recipe.ingredient_pro[position]:.2f}, '
+                      f'salt - {recipe.ingredient_sod[position]:.2f}, '
+                      f'saturates - {recipe.ingredient_sat[position]:.2f}, '
+                      f'sugars - {recipe.ingredient_sug[position]:.2f}')
+            selected.append([quantity, [recipe.ingredient_quantity[position], answer]])
+        return selected
+
+    def select(self, data_file: str) -> [list, list]:
+        # index only the ingredients whose quantity converts to a number
+        table = RecipeTable()
+        index = IngredientRecipeIndex(store=table)
+        for recipe in RecipeReader().read(data_file):
+            index.add(recipe, keep=lambda recipe_, position: self.convert(
+                recipe_.ingredient_quantity[position]) is not None)
+        table.freeze()
+
+        ingredient_count = index.count()
+        keys = sorted(ingredient_count, key=ingredient_count.get, reverse=False)
+        # the 12 smallest distinct quantities of every ingredient cover its training and test picks
+        selected = {key: self.smallest_quantities(index, key, 2 * self.quantities_per_ingredient) for key in keys}
 
         sample = []
-        sample_keys = []
-        for key in sorted(ingredient_count, key=ingredient_count.get, reverse=False):
-            # sort the quantities dictionary
-            counter = 0
-            quantities = ingredient_nutritional[key].copy()
-            for quantity in sorted(quantities, key=(lambda x: float(x)), reverse=False):
-                sample.append([key, quantity, quantities[quantity]])
-                sample_keys.append(f'{key} {quantities[quantity]}')
-                counter += 1
-                if counter == 6:
-                    break
+        sample_keys = set()
+        for key in keys:
+            for quantity, quantity_answer in selected[key][:self.quantities_per_ingredient]:
+                sample.append([key, quantity, quantity_answer])
+                sample_keys.add(f'{key} {quantity_answer}')
 
         sample_test = []
         sample_test_keys = []
-        for key in sorted(ingredient_count, key=ingredient_count.get, reverse=False):
-            # sort the quantities dictionary
+        for key in keys:
             counter = 0
-            quantities = ingredient_nutritional[key].copy()
-            for quantity in sorted(quantities, key=(lambda x: float(x)), reverse=False):
-                key_test = f'{key} {quantities[quantity]}'
+            candidates = selected[key]
+            if len(candidates) == 2 * self.quantities_per_ingredient \
+                    and any(f'{key} {quantity_answer}' in sample_keys
+                            for _, quantity_answer in candidates[self.quantities_per_ingredient:]):
+                # a test candidate collides with a training pair, the next quantities may be needed
+                candidates = self.smallest_quantities(index, key, None)
+            for quantity, quantity_answer in candidates:
+                key_test = f'{key} {quantity_answer}'
                 if key_test not in sample_keys:
-                    sample_test.append([key, quantity, quantities[quantity]])
+                    sample_test.append([key, quantity, quantity_answer])
                     sample_test_keys.append(key_test)
                     counter += 1
-                    if counter == 6:
+                    if counter == self.quantities_per_ingredient:
                         break
 
         for key in sample_test_keys:
             assert key not in sample_keys
 
+        return [sample, sample_test]
+
+    def render(self, sample: list, sample_test: list) -> dict:
+        questions = []
+        questions_test = []
+        answers = []
+        answers_test = []
+
         for i, j, k in sample:
             questions.append(f'{self.start} '
                              f'{self.ingredient_question_prompts[self.generate_random_number(
@@ -398,25 +393,48 @@ class IngredientQuantityNutrientValueSequenceGenerator(SequenceGenerator):
         return {'questions': questions, 'answers': answers,
                 'questions_test': questions_test, 'answers_test': answers_test}
 
+    def generate_sequences(self, data_file: str) -> dict:
+        return self.render(*self.select(data_file))
+
+    def generate_files(self, data_file: str, train_file: str, test_file: str, checkpoint_directory: str = None,
+                       writer: Writer = None, **write_options) -> bool:
+        """Generate and write the training and test files, skipped when both are up to date for this input."""
+        parameters = {'generator': type(self).__name__, 'random_seed': self.random_seed,
+                      'input': RecipeCache.file_hash(data_file)} | write_options
+        if Manifest(train_file).matches(parameters) and Manifest(test_file).matches(parameters):
+            return False
+
+        checkpoint = Checkpoint(checkpoint_directory, parameters) if checkpoint_directory is not None else None
+        state = checkpoint.load() if checkpoint is not None else None
+        if state is None:
+            sample, sample_test = self.select(data_file)
+            state = {'sample': sample, 'sample_test': sample_test, 'random': self.random.getstate()}
+            if checkpoint is not None:
+                checkpoint.save(state)
+        else:
+            self.random.setstate(state['random'])
+
+        writer = writer if writer is not None else Writer()
+        sequence = self.render(state['sample'], state['sample_test'])
+        write_output(writer, train_file, parameters, sequence['questions'], sequence['answers'], **write_options)
+        write_output(writer, test_file, parameters, sequence['questions_test'], sequence['answers_test'],
+                     **write_options)
+        if checkpoint is not None:
+            checkpoint.clear()
+        return True
+
 
 if __name__ == '__main__':
     file = r'path\to\input\file'
     directory = r'path\to\output\directory'
 
+    # the selected sample is saved here, so an interrupted run does not parse the input again
+    checkpoint_directory = r'path\to\checkpoint\directory'
+
     generator = IngredientQuantityNutrientValueSequenceGenerator()
-    sequence = generator.generate_sequences(file)
-
-    writer = Writer()
-    writer.write(
-        save_file=os.path.join(directory, f'ingredient_nutrient_value_training.txt'),
-        questions=sequence['questions'],
-        answers=sequence['answers'],
-        append=False
-    )
-
-    writer.write(
-        save_file=os.path.join(directory, f'ingredient_nutrient_value_test.txt'),
-        questions=sequence['questions_test'],
-        answers=sequence['answers_test'],
-        append=False
-    )
+    # outputs whose manifests match the input are skipped
+    generator.generate_files(file,
+                             train_file=os.path.join(directory, f'ingredient_nutrient_value_training.txt'),
+                             test_file=os.path.join(directory, f'ingredient_nutrient_value_test.txt'),
+                             checkpoint_directory=checkpoint_directory)
+    print('Quantity parsing:', generator.quantity_parser.stats())
@@ -0,0 +1,70 @@
+import functools
+import re
+from collections import Counter
+from fractions import Fraction
+
+
+class QuantityParser:
+    """Memoized parser of ingredient quantity strings ("1", "1/2", "1 1/2", "0.5").
+
+    Returns the same values as the former try/except conversion: None for ranges ("1-2", "2 to 3") and anything that
+    does not parse. Plain numbers and fractions are matched by regular expressions without raising, only unusual
+    strings go through the exception based conversion. The max_size most recently used strings are kept in an LRU
+    cache, the failure counts are kept outside it so they cover every call.
+    """
+    number = re.compile(r'\s*\d+(?:\.\d*)?\s*')
+    mixed_fraction = re.compile(r'\s*(?:\d+\s+)*\d+/\d+(?:\s+\d+(?:/\d+)?)*\s*')
+
+    def __init__(self, max_size: int = 1 << 20):
+        self.max_size = max_size
+        self.cached = functools.lru_cache(maxsize=max_size)(self.parse_uncached)
+        self.calls = 0
+        self.failures = Counter()
+
+    @staticmethod
+    def convert(q: str):
+        try:
+            if '-' in q or 'to' in q:
+                return None
+            elif '/' in q:
+                s = float(sum(Fraction(s) for s in q.split()))
+                return s
+            else:
+                return float(q)
+        except Exception:
+            return None
+
+    @classmethod
+    def parse_uncached(cls, q: str):
+        if '-' in q or 'to' in q:
+            return None
+        elif '/' in q:
+            if cls.mixed_fraction.fullmatch(q):
+                total = Fraction(0)
+                for part in q.split():
+                    numerator, _, denominator = part.partition('/')
+                    if denominator and int(denominator) == 0:
+                        return None
+                    total += Fraction(int(numerator), int(denominator) if denominator else 1)
+                return float(total)
+        elif cls.number.fullmatch(q):
+            return float(q)
+        return cls.convert(q)
+
+    def parse(self, q: str):
+        self.calls += 1
+        value = self.cached(q)
+        if value is None:
+            self.failures[q] += 1
+        return value
+
+    def __call__(self, q: str):
+        return self.parse(q)
+
+    def stats(self, most_common: int = 10) -> dict:
+        failed = sum(self.failures.values())
+        return {'calls': self.calls,
+                'distinct': self.cached.cache_info().currsize,
+                'failed': failed,
+                'failed_ratio': failed / self.calls if self.calls else 0.0,
+                'most_common_failures': self.failures.most_common(most_common)}
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from src.Entities import RecipeTable
+from src.IngredientRecipeIndex import IngredientRecipeIndex
+
+
+class RecipeCache:
+    """Binary cache of the parsed recipe table and ingredient index, keyed by the hash of the input file.
+
+    Numeric columns and index arrays are saved as .npy files and memory mapped on load, every string column is
+    saved as one NUL separated UTF-8 buffer and decoded with a single split, so later runs on the same input skip
+    parsing the JSON.
+    """
+    version = 2
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    @staticmethod
+    def file_hash(data_file: str) -> str:
+        digest = hashlib.sha256()
+        with open(data_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, data_file: str) -> str:
+        return os.path.join(self.directory, f'{self.file_hash(data_file)}_v{self.version}')
+
+    @staticmethod
+    def save_text(directory: str, name: str, texts: list) -> int:
+        data = '\x00'.join(texts)
+        if data.count('\x00') != max(len(texts) - 1, 0):
+            raise ValueError(f'Column {name} contains NUL characters and cannot be cached')
+        np.save(os.path.join(directory, f'{name}.npy'), np.frombuffer(data.encode('utf-8'), dtype=np.uint8))
+        return len(texts)
+
+    @staticmethod
+    def load_array(directory: str, name: str) -> np.ndarray:
+        # memory mapped, viewed as a plain ndarray to avoid the np.memmap overhead on every slice
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r').view(np.ndarray)
+
+    @classmethod
+    def load_text(cls, directory: str, name: str, count: int, intern: bool = False) -> list:
+        if count == 0:
+            return []
+        texts = cls.load_array(directory, name).tobytes().decode('utf-8').split('\x00')
+        if intern:
+            # ingredient names, quantities and units repeat a lot, keep one string object per distinct value
+            strings = dict()
+            texts = [strings.setdefault(text, text) for text in texts]
+        return texts
+
+    def save(self, data_file: str, index: IngredientRecipeIndex):
+        table = index.recipes
+        if not isinstance(table, RecipeTable) or not table.frozen:
+            raise ValueError('Only an index over a frozen RecipeTable can be cached')
+
+        path = self.path(data_file)
+        temporary = path + '.tmp'
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+
+        counts = dict()
+        for column in table.recipe_text_columns + table.ingredient_text_columns + ['instructions']:
+            counts[column] = self.save_text(temporary, column, table.columns[column])
+        for column in table.recipe_value_columns + table.ingredient_value_columns:
+            np.save(os.path.join(temporary, f'{column}.npy'), table.columns[column])
+        np.save(os.path.join(temporary, 'offsets.npy'), table.offsets)
+        np.save(os.path.join(temporary, 'instruction_offsets.npy'), table.instruction_offsets)
+        with open(os.path.join(temporary, 'ragged.json'), 'w', encoding='utf-8') as f:
+            json.dump({str(row): lists for row, lists in table.ragged.items()}, f)
+
+        keys = list(index.keys())
+        counts['index_keys'] = self.save_text(temporary, 'index_keys', keys)
+        key_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(index.recipe_ids[key]) for key in keys], out=key_offsets[1:])
+        np.save(os.path.join(temporary, 'index_key_offsets.npy'), key_offsets)
+        for name, arrays in [['index_recipe_ids', index.recipe_ids], ['index_positions', index.ingredient_positions]]:
+            values = np.concatenate([np.asarray(arrays[key], dtype=np.uint32) for key in keys]) if keys \
+                else np.zeros(0, dtype=np.uint32)
+            np.save(os.path.join(temporary, f'{name}.npy'), values)
+
+        with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'data_file': os.path.abspath(data_file), 'counts': counts}, f)
+
+        # the cache only becomes visible once it is complete
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary, path)
+
+    def load(self, data_file: str):
+        path = self.path(data_file)
+        if not os.path.isfile(os.path.join(path, 'meta.json')):
+            return None
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            counts = json.load(f)['counts']
+
+        table = RecipeTable()
+        for column in table.recipe_text_columns + table.ingredient_text_columns + ['instructions']:
+            table.columns[column] = self.load_text(path, column, counts[column],
+                                                   intern=column in table.ingredient_text_columns)
+        for column in table.recipe_value_columns + table.ingredient_value_columns:
+            table.columns[column] = self.load_array(path, column)
+        table.offsets = self.load_array(path, 'offsets')
+        table.instruction_offsets = self.load_array(path, 'instruction_offsets')
+        with open(os.path.join(path, 'ragged.json'), encoding='utf-8') as f:
+            table.ragged = {int(row): lists for row, lists in json.load(f).items()}
+        table.strings = dict()
+        table.frozen = True
+
+        index = IngredientRecipeIndex(store=table)
+        key_offsets = np.load(os.path.join(path, 'index_key_offsets.npy')).tolist()
+        recipe_ids = self.load_array(path, 'index_recipe_ids')
+        positions = self.load_array(path, 'index_positions')
+        keys = self.load_text(path, 'index_keys', counts['index_keys'])
+        for key, start, stop in zip(keys, key_offsets[:-1], key_offsets[1:]):
+            index.recipe_ids[key] = recipe_ids[start:stop]
+            index.ingredient_positions[key] = positions[start:stop]
+        return index
+
+    def load_or_build(self, data_file: str, build) -> IngredientRecipeIndex:
+        index = self.load(data_file)
+        if index is None:
+            index = build(data_file)
+            try:
+                self.save(data_file, index)
+            except ValueError as e:
+                print('Not caching', data_file, e)
+        return index
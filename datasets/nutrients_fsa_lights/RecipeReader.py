@@ -0,0 +1,54 @@
+import json
+
+from src.Entities import Recipe
+
+
+class RecipeReader:
+    """Incremental reader for the Recipe1M+ JSON array, yields one entry at a time instead of calling json.load."""
+
+    def __init__(self, chunk_size: int = 1 << 20):
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    @staticmethod
+    def skip(buffer: str, position: int, characters: str) -> int:
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] in characters):
+            position += 1
+        return position
+
+    def read_instances(self, data_file: str):
+        with open(data_file, encoding="utf-8") as f:
+            buffer = f.read(self.chunk_size)
+            position = self.skip(buffer, 0, '')
+            while position >= len(buffer) and buffer:
+                buffer = f.read(self.chunk_size)
+                position = self.skip(buffer, 0, '')
+            if position >= len(buffer) or buffer[position] != '[':
+                raise ValueError(f'{data_file} does not contain a JSON array')
+            position += 1
+            eof = False
+
+            while True:
+                position = self.skip(buffer, position, ',')
+                if position < len(buffer) and buffer[position] == ']':
+                    return
+                try:
+                    if position >= len(buffer):
+                        raise json.JSONDecodeError('Unterminated array', buffer, position)
+                    instance, end = self.decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # the entry continues in the next chunk, read at least as much as is buffered so that
+                    # entries larger than a chunk are not re-decoded once per chunk
+                    chunk = f.read(max(self.chunk_size, len(buffer) - position))
+                    eof = not chunk
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield instance
+                position = end
+
+    def read(self, data_file: str):
+        for instance in self.read_instances(data_file):
+            yield Recipe(instance)
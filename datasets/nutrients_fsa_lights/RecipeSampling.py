@@ -1,9 +1,15 @@
-import json
+import functools
 import os
 import random
 from abc import ABC, abstractmethod
 
-from src.Entities import Recipe
+from src.Checkpoints import Checkpoint, Manifest, write_output
+from src.Entities import RecipeRow, RecipeTable
+from src.IngredientRecipeIndex import IngredientRecipeIndex
+from src.RecipeCache import RecipeCache
+from src.RecipeReader import RecipeReader
+from src.SamplingState import SamplingState
+from src.SimilarityIndex import JaccardIndex
 from src.Writer import Writer
 
 
@@ -12,29 +18,95 @@ class SequenceGenerator(ABC):
     end = '[/INST]'
 
     def __init__(self, random_seed: int, max_count: int, max_jaccard: float):
-        random.seed(random_seed)
+        # every generator owns its random stream, Random(seed) draws the same numbers as random.seed(seed) did
+        self.random = random.Random(random_seed)
         self.random_seed = random_seed
         self.max_count = max_count
         self.max_jaccard = max_jaccard
 
     @abstractmethod
-    def sample(self, count: dict, recipes: dict, used_recipe_ids: list,
-               used_recipe_titles: list, used_recipe_ingredients: list) -> [list, list, list, list, list, list]:
+    def sample(self, index: IngredientRecipeIndex, used: SamplingState) -> [list, list, SamplingState]:
         raise NotImplementedError()
 
     @abstractmethod
     def generate(self, sample: list, ingredients: list) -> dict:
         raise NotImplementedError()
 
-    def generate_sequences(self, data_file: str) -> dict:
-        [count, recipes] = self.read_file(data_file)
-        [sample, ingredients, recipe_ids, recipe_titles, recipe_ingredient_strings] = self.sample(
-            count, recipes, [], [], [])
-        [sample_test, ingredients_test, _, _, _] = self.sample(count, recipes, recipe_ids, recipe_titles, recipe_ingredient_strings)
+    def generate_sequences(self, data_file: str, cache_directory: str = None) -> dict:
+        return self.generate_from_index(self.load_index(data_file, cache_directory))
+
+    def generate_from_index(self, index: IngredientRecipeIndex, token_frequency: dict = None) -> dict:
+        if token_frequency is None:
+            token_frequency = self.ingredient_frequency(index)
+        [sample, ingredients, state] = self.sample(index, SamplingState(self.max_jaccard, token_frequency))
+        [sample_test, ingredients_test, _] = self.sample(index, state)
         prompts = self.generate(sample, ingredients)
         prompts_test = self.generate(sample_test, ingredients_test)
         return prompts, prompts_test
 
+    def parameters(self, input_hash: str) -> dict:
+        return {'generator': type(self).__name__, 'random_seed': self.random_seed, 'max_count': self.max_count,
+                'max_jaccard': self.max_jaccard, 'input': input_hash}
+
+    @staticmethod
+    def sample_positions(index: IngredientRecipeIndex, sample: list) -> list:
+        # the sampled recipes are saved by their position in the store, the rest of a sample entry as is
+        if all(isinstance(recipe, RecipeRow) for _, recipe, _, _ in sample):
+            return [[recipe.row, id_, title, ingredients] for id_, recipe, title, ingredients in sample]
+        positions = {id(recipe): position for position, recipe in enumerate(index.recipes)}
+        return [[positions[id(recipe)], id_, title, ingredients] for id_, recipe, title, ingredients in sample]
+
+    @staticmethod
+    def restore_sample(index: IngredientRecipeIndex, saved: list) -> list:
+        return [[id_, index.recipes[position], title, ingredients] for position, id_, title, ingredients in saved]
+
+    def generate_files(self, load_index, train_file: str, test_file: str, input_hash: str,
+                       checkpoint_directory: str = None, writer: Writer = None, token_frequency: dict = None,
+                       **write_options) -> bool:
+        """Generate and write the training and test files, resuming from the last checkpoint of the same job.
+
+        load_index is only called when an output is missing or changed, returns False when both were up to date.
+        """
+        parameters = self.parameters(input_hash) | write_options
+        if Manifest(train_file).matches(parameters) and Manifest(test_file).matches(parameters):
+            return False
+
+        index = load_index()
+        checkpoint = Checkpoint(checkpoint_directory, parameters) if checkpoint_directory is not None else None
+        state = checkpoint.load() if checkpoint is not None else None
+
+        if state is None:
+            if token_frequency is None:
+                token_frequency = self.ingredient_frequency(index)
+            [sample, ingredients, used] = self.sample(index, SamplingState(self.max_jaccard, token_frequency))
+            state = {'sample': self.sample_positions(index, sample), 'ingredients': ingredients, 'used': used,
+                     'random': self.random.getstate()}
+            if checkpoint is not None:
+                checkpoint.save(state)
+        else:
+            sample = self.restore_sample(index, state['sample'])
+            self.random.setstate(state['random'])
+
+        if 'sample_test' not in state:
+            [sample_test, ingredients_test, _] = self.sample(index, state['used'])
+            state |= {'sample_test': self.sample_positions(index, sample_test), 'ingredients_test': ingredients_test,
+                      'random': self.random.getstate()}
+            if checkpoint is not None:
+                checkpoint.save(state)
+        else:
+            sample_test = self.restore_sample(index, state['sample_test'])
+            self.random.setstate(state['random'])
+
+        writer = writer if writer is not None else Writer()
+        prompts = self.generate(sample, state['ingredients'])
+        prompts_test = self.generate(sample_test, state['ingredients_test'])
+        write_output(writer, train_file, parameters, prompts['questions'], prompts['answers'], **write_options)
+        write_output(writer, test_file, parameters, prompts_test['questions'], prompts_test['answers'],
+                     **write_options)
+        if checkpoint is not None:
+            checkpoint.clear()
+        return True
+
     @staticmethod
     def jaccard_similarity(list_a: list, list_b: list) -> float:
         if list_a == list_b:
@@ -44,64 +116,58 @@ class SequenceGenerator(ABC):
         return float(len(s1.intersection(s2)) / len(s1.union(s2)))
 
     @staticmethod
-    def generate_random_number(start: int, end: int) -> int:
-        number = random.randint(start, end)
+    def ingredient_frequency(index: IngredientRecipeIndex) -> dict:
+        return JaccardIndex.count_tokens(recipe.ingredients for recipe in index.recipes)
+
+    def generate_random_number(self, start: int, end: int) -> int:
+        number = self.random.randint(start, end)
         return number
 
-    @staticmethod
-    def generate_shuffled_indexes(count: int):
+    def generate_shuffled_indexes(self, count: int):
         indexes = list(range(count))
-        random.shuffle(indexes)
+        self.random.shuffle(indexes)
         return indexes
 
+    @classmethod
+    def load_index(cls, data_file: str, cache_directory: str = None) -> IngredientRecipeIndex:
+        if cache_directory is not None:
+            return RecipeCache(cache_directory).load_or_build(data_file, cls.read_file)
+        return cls.read_file(data_file)
+
     @staticmethod
-    def read_file(data_file: str) -> [dict, dict]:
-        count = dict()
-        recipes = dict()
-
-        with open(data_file, encoding="utf-8") as f:
-            instances = json.load(f)
-            for i, instance in enumerate(instances):
-                recipe = Recipe(instance)
-
-                for ingredient, quant, unit, fat, ngr, pro, sat, sod, sug in zip(recipe.ingredients,
-                                                                                 recipe.ingredient_quantity,
-                                                                                 recipe.ingredient_unit,
-                                                                                 recipe.ingredient_fat,
-                                                                                 recipe.ingredient_nrg,
-                                                                                 recipe.ingredient_pro,
-                                                                                 recipe.ingredient_sat,
-                                                                                 recipe.ingredient_sod,
-                                                                                 recipe.ingredient_sug):
-                    ingredient_unit = f'{unit} {ingredient}'
-
-                    if ingredient_unit not in count.keys():
-                        count[ingredient_unit] = 1
-                        recipes_ = [recipe]
-                        recipes[ingredient_unit] = recipes_.copy()
-                    else:
-                        count[ingredient_unit] = int(count[ingredient_unit]) + 1
-                        recipes_ = recipes[ingredient_unit].copy()
-                        recipes_.append(recipe)
-                        recipes[ingredient_unit] = recipes_.copy()
+    def read_file(data_file: str, columnar: bool = True) -> IngredientRecipeIndex:
+        # the columnar table keeps a million recipes in a fraction of the memory of Recipe objects
+        table = RecipeTable() if columnar else None
+        index = IngredientRecipeIndex(store=table)
 
-        return [count, recipes]
+        # entries are parsed one at a time, so only the built index is held in memory
+        for recipe in RecipeReader().read(data_file):
+            index.add(recipe)
+
+        if columnar:
+            table.freeze()
+        return index
 
 
 class RecipeSequenceGenerator(SequenceGenerator, ABC):
-    def sample(self, count: dict, recipes: dict,
-               used_recipe_ids: list, used_recipe_titles: list, used_recipe_ingredients: list) -> [list, list, list, list, list, list]:
-        recipe_id_in_sample = []
-        recipe_title_in_sample = []
-        recipe_ingredients_in_sample = []
+    nutrition_answer = ('energy - {:.2f}, fat - {:.2f}, protein - {:.2f}, salt - {:.2f}, saturates - {:.2f}, '
+                        'sugars - {:.2f}')
+    nutrition_columns = ['energy_value', 'fat_value', 'protein_value', 'salt_value', 'saturates_value',
+                         'sugars_value']
+    fsa_answer = 'fat - {}, salt - {}, saturates - {}, sugars - {}'
+    fsa_columns = ['fat_fsa', 'salt_fsa', 'saturates_fsa', 'sugars_fsa']
+
+    def sample(self, index: IngredientRecipeIndex, used: SamplingState) -> [list, list, SamplingState]:
+        # candidates are only compared with previously sampled sets that share a rare ingredient with them
+        in_sample = SamplingState(self.max_jaccard, used.token_frequency)
         ingredient_count = dict()
 
         i = 0
         sample = []
-        for key in sorted(count, key=count.get, reverse=False):
+        for key in index.keys_by_count(reverse=False):
             # sort the quantities dictionary
             i += 1
-            recipes_ = recipes[key]
+            recipes_ = index.get(key)
             indexes = self.generate_shuffled_indexes(count=len(recipes_))
             recipes_shuffled = [recipes_[i] for i in indexes]
 
@@ -111,47 +177,29 @@ class RecipeSequenceGenerator(SequenceGenerator, ABC):
                 for ingredient in sorted(recipe_temp.ingredients):
                     ingredient_set_temp.append(ingredient.lower())
 
-                if recipe_temp.id_ in recipe_id_in_sample:
+                if in_sample.contains_id(recipe_temp.id_):
                     continue
-                if recipe_temp.id_ in used_recipe_ids:
+                if used.contains_id(recipe_temp.id_):
                     continue
 
-                if recipe_temp.title.lower() in recipe_title_in_sample:
+                if in_sample.contains_title(recipe_temp.title.lower()):
                     continue
-                if recipe_temp.title.lower() in used_recipe_titles:
+                if used.contains_title(recipe_temp.title.lower()):
                     continue
 
                 if key in ingredient_count.keys() and int(ingredient_count[key]) >= self.max_count:
                     continue
 
-                # find max jaccard similarity with currently sampled set
-                max_ = 0.0
-                for sampled_set in recipe_ingredients_in_sample:
-                    jaccard_similarity = self.jaccard_similarity(ingredient_set_temp, sampled_set)
-                    if jaccard_similarity > max_:
-                        max_ = jaccard_similarity
-                        if max_ >= self.max_jaccard:
-                            break
-
-                if max_ >= self.max_jaccard:
+                # check max jaccard similarity with currently sampled set
+                if in_sample.too_similar(ingredient_set_temp):
                     continue
 
-                # find max jaccard similarity with previously sampled set (training set)
-                max_ = 0.0
-                for sampled_set in used_recipe_ingredients:
-                    jaccard_similarity = self.jaccard_similarity(ingredient_set_temp, sampled_set)
-                    if jaccard_similarity > max_:
-                        max_ = jaccard_similarity
-                        if max_ >= self.max_jaccard:
-                            break
-
-                if max_ >= self.max_jaccard:
+                # check max jaccard similarity with previously sampled set (training set)
+                if used.too_similar(ingredient_set_temp):
                     continue
 
                 sample.append([recipe_temp.id_, recipe_temp, recipe_temp.title, '; '.join(sorted(ingredient_set_temp))])
-                recipe_id_in_sample.append(recipe_temp.id_)
-                recipe_title_in_sample.append(recipe_temp.title.lower())
-                recipe_ingredients_in_sample.append(ingredient_set_temp)
+                in_sample.add(recipe_temp.id_, recipe_temp.title.lower(), ingredient_set_temp)
 
                 # update sample_ingredient_count dictionary after taking the sample
                 for ing, un in zip(recipe_temp.ingredients, recipe_temp.ingredient_unit):
@@ -166,8 +214,77 @@ class RecipeSequenceGenerator(SequenceGenerator, ABC):
                     break
 
         return [sample, [[k, ingredient_count[k]] for k in sorted(
-            ingredient_count, key=ingredient_count.get, reverse=True)],
-                recipe_id_in_sample, recipe_title_in_sample, recipe_ingredients_in_sample]
+            ingredient_count, key=ingredient_count.get, reverse=True)], in_sample]
+
+    def template_indexes(self, count: int, question_prompts: list, answer_prompts: list) -> [list, list]:
+        # drawn in the order of the former per recipe loop (question, answer, question, ...), so every seed
+        # still renders the same prompts
+        randint = self.random.randint
+        last_question = len(question_prompts) - 1
+        last_answer = len(answer_prompts) - 1
+        indexes = [[randint(0, last_question), randint(0, last_answer)] for _ in range(count)]
+        return [[question for question, _ in indexes], [answer for _, answer in indexes]]
+
+    @staticmethod
+    def shared_table(recipes: list):
+        """The RecipeTable when all recipes are rows of the same table, so their columns can be read in bulk."""
+        if recipes and all(isinstance(recipe, RecipeRow) for recipe in recipes) \
+                and len({id(recipe.table) for recipe in recipes}) == 1:
+            return recipes[0].table
+        return None
+
+    @classmethod
+    def recipe_columns(cls, recipes: list, columns: list) -> list:
+        table = cls.shared_table(recipes)
+        if table is None:
+            return [tuple(getattr(recipe, column) for column in columns) for recipe in recipes]
+
+        rows = [recipe.row for recipe in recipes]
+        values = []
+        for column in columns:
+            if column in table.recipe_value_columns:
+                values.append(table.columns[column][rows].tolist())
+            else:
+                values.append([table.columns[column][row] for row in rows])
+        return list(zip(*values))
+
+    @staticmethod
+    def ingredient_list(recipe) -> str:
+        return ', '.join([f'{quantity} {unit} {ingredient}' for ingredient, quantity, unit in zip(
+            recipe.ingredients, recipe.ingredient_quantity, recipe.ingredient_unit)]).strip()
+
+    @classmethod
+    def ingredient_lists(cls, recipes: list) -> list:
+        table = cls.shared_table(recipes)
+        if table is None:
+            return [cls.ingredient_list(recipe) for recipe in recipes]
+
+        rows = [recipe.row for recipe in recipes]
+        starts = table.offsets[rows].tolist()
+        stops = table.offsets[[row + 1 for row in rows]].tolist()
+        ingredients = table.columns['ingredients']
+        quantities = table.columns['ingredient_quantity']
+        units = table.columns['ingredient_unit']
+        return [', '.join([f'{quantities[i]} {units[i]} {ingredients[i]}' for i in range(start, stop)]).strip()
+                if row not in table.ragged else cls.ingredient_list(recipe)
+                for recipe, row, start, stop in zip(recipes, rows, starts, stops)]
+
+    def render(self, sample: list, question_prompts: list, answer_prompts: list, answer: str, answer_columns: list,
+               titled: bool = False) -> dict:
+        """Questions and answers of a whole sample, the answer is formatted from the answer_columns of every recipe."""
+        recipes = [recipe for _, recipe, _, _ in sample]
+        question_indexes, answer_indexes = self.template_indexes(len(recipes), question_prompts, answer_prompts)
+        if titled:
+            question_texts = [question_prompts[i].replace('a recipe', f'{title}')
+                              for i, (_, _, title, _) in zip(question_indexes, sample)]
+        else:
+            question_texts = [question_prompts[i] for i in question_indexes]
+
+        questions = [f'{self.start} {question_text} {ingredient_list} {self.end}'
+                     for question_text, ingredient_list in zip(question_texts, self.ingredient_lists(recipes))]
+        answers = [f'{answer_prompts[i]} {answer.format(*values)}'
+                   for i, values in zip(answer_indexes, self.recipe_columns(recipes, answer_columns))]
+        return {'questions': questions, 'answers': answers}
 
 
 class RecipeIngrNutritionSequenceGenerator(RecipeSequenceGenerator):
@@ -505,32 +622,8 @@ class RecipeIngrNutritionSequenceGenerator(RecipeSequenceGenerator):
     ]
 
     def generate(self, sample: list, ingredients: list) -> dict:
-        questions = []
-        answers = []
-
-        for i, recipe, _, _ in sample:
-            question = ''
-            for ingredient, quantity, unit in zip(recipe.ingredients, recipe.ingredient_quantity,
-                                                  recipe.ingredient_unit):
-                question += f'{quantity} {unit} {ingredient}, '
-            question = question[:-2]
-
-            answer = (f'energy - {recipe.energy_value:.2f}, fat - {recipe.fat_value:.2f}, '
-                      f'protein - {recipe.protein_value:.2f}, salt - {recipe.salt_value:.2f}, '
-                      f'saturates - {recipe.saturates_value:.2f}, sugars - {recipe.sugars_value:.2f}')
-
-            questions.append(
-                f'{self.start} '
-                f'{self.recipe_question_prompts[
-                    self.generate_random_number(0, len(self.recipe_question_prompts) - 1)]}'
-                f' {question.strip()} {self.end}')
-
-            answers.append(
-                f'{self.recipe_answer_prompts[
-                    self.generate_random_number(0, len(self.recipe_answer_prompts) - 1)]}'
-                f' {answer}')
-
-        return {'questions': questions, 'answers': answers}
+        return self.render(sample, self.recipe_question_prompts, self.recipe_answer_prompts,
+                           self.nutrition_answer, self.nutrition_columns)
 
 
 class RecipeTitlIngrNutritionSequenceGenerator(RecipeSequenceGenerator):
@@ -868,34 +961,8 @@ class RecipeTitlIngrNutritionSequenceGenerator(RecipeSequenceGenerator):
     ]
 
     def generate(self, sample: list, ingredients: list) -> dict:
-        questions = []
-        answers = []
-
-        for i, recipe, _, _ in sample:
-            question = ''
-
-            for ingredient, quantity, unit in zip(recipe.ingredients, recipe.ingredient_quantity,
-                                                  recipe.ingredient_unit):
-                question += f'{quantity} {unit} {ingredient}, '
-            question = question[:-2]
-
-            answer = (f'energy - {recipe.energy_value:.2f}, fat - {recipe.fat_value:.2f}, '
-                      f'protein - {recipe.protein_value:.2f}, salt - {recipe.salt_value:.2f}, '
-                      f'saturates - {recipe.saturates_value:.2f}, sugars - {recipe.sugars_value:.2f}')
-
-            question_prompt = self.recipe_question_prompts[
-                self.generate_random_number(0, len(self.recipe_question_prompts) - 1)]
-
-            questions.append(
-                f'{self.start} '
-                f'{question_prompt.replace('a recipe', f'{recipe.title}')}'
-                f' {question.strip()} {self.end}')
-            answers.append(
-                f'{self.recipe_answer_prompts[
-                    self.generate_random_number(0, len(self.recipe_answer_prompts) - 1)]}'
-                f' {answer}')
-
-        return {'questions': questions, 'answers': answers}
+        return self.render(sample, self.recipe_question_prompts, self.recipe_answer_prompts,
+                           self.nutrition_answer, self.nutrition_columns, titled=True)
 
 
 class RecipeIngrFsaSequenceGenerator(RecipeSequenceGenerator):
@@ -1233,29 +1300,8 @@ class RecipeIngrFsaSequenceGenerator(RecipeSequenceGenerator):
     ]
 
     def generate(self, sample: list, ingredients: list) -> dict:
-        questions = []
-        answers = []
-
-        for i, recipe, _, _ in sample:
-            question = ''
-
-            for ingredient, quantity, unit in zip(recipe.ingredients, recipe.ingredient_quantity,
-                                                  recipe.ingredient_unit):
-                question += f'{quantity} {unit} {ingredient}, '
-            question = question[:-2]
-
-            answer = (f'fat - {recipe.fat_fsa}, '
-                      f'salt - {recipe.salt_fsa}, saturates - {recipe.saturates_fsa}, sugars - {recipe.sugars_fsa}')
-
-            questions.append(f'{self.start} '
-                             f'{self.fsa_lights_question_prompts[
-                                 self.generate_random_number(0, len(self.fsa_lights_question_prompts) - 1)]}'
-                             f' {question.strip()} {self.end}')
-            answers.append(
-                f'{self.fsa_lights_answer_prompts[self.generate_random_number(0, len(self.fsa_lights_answer_prompts) - 1)]}'
-                f' {answer}')
-
-        return {'questions': questions, 'answers': answers}
+        return self.render(sample, self.fsa_lights_question_prompts, self.fsa_lights_answer_prompts,
+                           self.fsa_answer, self.fsa_columns)
 
 
 class RecipeTitlIngrFsaSequenceGenerator(RecipeSequenceGenerator):
@@ -1593,32 +1639,8 @@ class RecipeTitlIngrFsaSequenceGenerator(RecipeSequenceGenerator):
     ]
 
     def generate(self, sample: list, ingredients: list) -> dict:
-        questions = []
-        answers = []
-
-        for i, recipe, _, _ in sample:
-            question = ''
-
-            for ingredient, quantity, unit in zip(recipe.ingredients, recipe.ingredient_quantity,
-                                                  recipe.ingredient_unit):
-                question += f'{quantity} {unit} {ingredient}, '
-            question = question[:-2]
-
-            answer = (f'fat - {recipe.fat_fsa}, '
-                      f'salt - {recipe.salt_fsa}, saturates - {recipe.saturates_fsa}, sugars - {recipe.sugars_fsa}')
-
-            question_prompt = self.fsa_lights_question_prompts[
-                self.generate_random_number(0, len(self.fsa_lights_question_prompts) - 1)]
-
-            questions.append(f'{self.start} '
-                             f'{question_prompt.replace('a recipe', f'{recipe.title}')}'
-                             f' {question.strip()} {self.end}')
-            answers.append(
-                f'{self.fsa_lights_answer_prompts[
-                    self.generate_random_number(0, len(self.fsa_lights_answer_prompts) - 1)]}'
-                f' {answer}')
-
-        return {'questions': questions, 'answers': answers}
+        return self.render(sample, self.fsa_lights_question_prompts, self.fsa_lights_answer_prompts,
+                           self.fsa_answer, self.fsa_columns, titled=True)
 
 
 if __name__ == '__main__':
@@ -1628,93 +1650,67 @@ if __name__ == '__main__':
 
     file = r'path\to\input\json\file'
     directory = r'path\to\output\directory'
+    # the parsed input is cached here on the first run and memory mapped on later runs (e.g. for other seeds)
+    cache_directory = r'path\to\cache\directory'
+    # interrupted runs resume from the sampling state saved here, outputs whose manifests match are skipped
+    checkpoint_directory = r'path\to\checkpoint\directory'
 
-    writer = Writer()
+    input_hash = RecipeCache.file_hash(file)
+    # only parsed once, and only if some output has to be generated
+    load_index = functools.cache(lambda: SequenceGenerator.load_index(file, cache_directory))
 
     # recipe ingredients -> nutritional values
     generator = RecipeIngrNutritionSequenceGenerator(random_seed=random_seed,
                                                      max_count=max_count,
                                                      max_jaccard=max_jaccard)
-    sequence, sequence_test = generator.generate_sequences(file)
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_ing_nutrition', str(random_seed),
-                               f'dataset_training_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence['questions'],
-        answers=sequence['answers'],
-        append=False
-    )
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_ing_nutrition', str(random_seed),
+    generator.generate_files(
+        load_index,
+        train_file=os.path.join(directory, 'recipes_ing_nutrition', str(random_seed),
+                                f'dataset_training_{generator.max_count}_{random_seed}.txt'),
+        test_file=os.path.join(directory, 'recipes_ing_nutrition', str(random_seed),
                                f'dataset_test_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence_test['questions'],
-        answers=sequence_test['answers'],
-        append=False
+        input_hash=input_hash,
+        checkpoint_directory=checkpoint_directory
     )
 
     # recipe title and ingredients -> nutritional values
     generator = RecipeTitlIngrNutritionSequenceGenerator(random_seed=random_seed,
                                                          max_count=max_count,
                                                          max_jaccard=max_jaccard)
-    sequence, sequence_test = generator.generate_sequences(file)
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_title_ing_nutrition', str(random_seed),
-                               f'dataset_training_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence['questions'],
-        answers=sequence['answers'],
-        append=False
-    )
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_title_ing_nutrition', str(random_seed),
+    generator.generate_files(
+        load_index,
+        train_file=os.path.join(directory, 'recipes_title_ing_nutrition', str(random_seed),
+                                f'dataset_training_{generator.max_count}_{random_seed}.txt'),
+        test_file=os.path.join(directory, 'recipes_title_ing_nutrition', str(random_seed),
                                f'dataset_test_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence_test['questions'],
-        answers=sequence_test['answers'],
-        append=False
+        input_hash=input_hash,
+        checkpoint_directory=checkpoint_directory
     )
 
     # recipe ingredients -> fsa lights
     generator = RecipeIngrFsaSequenceGenerator(random_seed=random_seed,
                                                max_count=max_count,
                                                max_jaccard=max_jaccard)
-    sequence, sequence_test = generator.generate_sequences(file)
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_ing_fsa', str(random_seed),
-                               f'dataset_training_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence['questions'],
-        answers=sequence['answers'],
-        append=False
-    )
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_ing_fsa', str(random_seed),
+    generator.generate_files(
+        load_index,
+        train_file=os.path.join(directory, 'recipes_ing_fsa', str(random_seed),
+                                f'dataset_training_{generator.max_count}_{random_seed}.txt'),
+        test_file=os.path.join(directory, 'recipes_ing_fsa', str(random_seed),
                                f'dataset_test_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence_test['questions'],
-        answers=sequence_test['answers'],
-        append=False
+        input_hash=input_hash,
+        checkpoint_directory=checkpoint_directory
     )
 
     # recipe title and ingredients -> fsa lights
     generator = RecipeTitlIngrFsaSequenceGenerator(random_seed=random_seed,
                                                    max_count=max_count,
                                                    max_jaccard=max_jaccard)
-    sequence, sequence_test = generator.generate_sequences(file)
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_title_ing_fsa', str(random_seed),
-                               f'dataset_training_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence['questions'],
-        answers=sequence['answers'],
-        append=False
-    )
-
-    writer.write(
-        save_file=os.path.join(directory, 'recipes_title_ing_fsa', str(random_seed),
+    generator.generate_files(
+        load_index,
+        train_file=os.path.join(directory, 'recipes_title_ing_fsa', str(random_seed),
+                                f'dataset_training_{generator.max_count}_{random_seed}.txt'),
+        test_file=os.path.join(directory, 'recipes_title_ing_fsa', str(random_seed),
                                f'dataset_test_{generator.max_count}_{random_seed}.txt'),
-        questions=sequence_test['questions'],
-        answers=sequence_test['answers'],
-        append=False
+        input_hash=input_hash,
+        checkpoint_directory=checkpoint_directory
     )
@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import time
+
+from src.Checkpoints import Manifest
+from src.RecipeCache import RecipeCache
+from src.RecipeSampling import (SequenceGenerator, RecipeIngrNutritionSequenceGenerator,
+                                RecipeTitlIngrNutritionSequenceGenerator, RecipeIngrFsaSequenceGenerator,
+                                RecipeTitlIngrFsaSequenceGenerator)
+
+# output directory and random seeds of every generator, as listed in datasets/README.md
+seed_matrix = {
+    RecipeIngrNutritionSequenceGenerator: ['recipes_ing_nutrition', [107473, 234053, 442417, 619176, 777572]],
+    RecipeTitlIngrNutritionSequenceGenerator: ['recipes_title_ing_nutrition',
+                                               [206184, 384578, 512894, 638165, 767065]],
+    RecipeIngrFsaSequenceGenerator: ['recipes_ing_fsa', [120459, 228727, 398065, 537363, 638908]],
+    RecipeTitlIngrFsaSequenceGenerator: ['recipes_title_ing_fsa', [150769, 359225, 476390, 755236, 812461]],
+}
+
+extensions = {'inst': '.txt', 'tsv': '.tsv'}
+compression_extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# parsed dataset shared by the worker processes, inherited copy-on-write when the pool forks
+shared_index = None
+shared_token_frequency = None
+
+
+def initialize_worker(data_file: str, cache_directory: str):
+    global shared_index, shared_token_frequency
+    if shared_index is None:
+        # spawned workers (e.g. on Windows) load the dataset themselves, memory mapped when it is cached
+        shared_index = SequenceGenerator.load_index(data_file, cache_directory)
+        shared_token_frequency = SequenceGenerator.ingredient_frequency(shared_index)
+
+
+def output_files(job: list) -> list:
+    generator_class, random_seed, max_count, _, directory, layout, compression, _, _ = job
+    output_directory = os.path.join(directory, seed_matrix[generator_class][0], str(random_seed))
+    extension = extensions[layout] + compression_extensions[compression]
+    return [os.path.join(output_directory, f'dataset_training_{max_count}_{random_seed}{extension}'),
+            os.path.join(output_directory, f'dataset_test_{max_count}_{random_seed}{extension}')]
+
+
+def run_job(job: list) -> list:
+    generator_class, random_seed, max_count, max_jaccard, _, layout, compression, input_hash, checkpoint_directory = job
+    start = time.perf_counter()
+
+    generator = generator_class(random_seed=random_seed, max_count=max_count, max_jaccard=max_jaccard)
+    train_file, test_file = output_files(job)
+    generated = generator.generate_files(lambda: shared_index, train_file, test_file, input_hash,
+                                         checkpoint_directory=checkpoint_directory,
+                                         token_frequency=shared_token_frequency, layout=layout,
+                                         compression=compression)
+    return [generator_class.__name__, random_seed, Manifest(train_file).read()['rows'],
+            Manifest(test_file).read()['rows'], generated, time.perf_counter() - start]
+
+
+def run_all(data_file: str, directory: str, max_count: int = 20, max_jaccard: float = 0.75,
+            cache_directory: str = None, processes: int = None, generators: list = None, layout: str = 'inst',
+            compression: str = None, checkpoint_directory: str = None):
+    """Generate every (generator, seed) output that is missing or out of date.
+
+    layout='tsv' writes the instruction/output files of preprocess.py directly instead of the [INST] text files.
+    Jobs save their sampling state in checkpoint_directory and resume from it after an interruption.
+    """
+    global shared_index, shared_token_frequency
+    input_hash = RecipeCache.file_hash(data_file)
+    jobs = [[generator_class, random_seed, max_count, max_jaccard, directory, layout, compression, input_hash,
+             checkpoint_directory]
+            for generator_class in (generators if generators is not None else seed_matrix)
+            for random_seed in seed_matrix[generator_class][1]]
+
+    # outputs whose manifests match the input and parameters are skipped without parsing the input
+    pending = []
+    for job in jobs:
+        parameters = job[0](random_seed=job[1], max_count=max_count, max_jaccard=max_jaccard).parameters(
+            input_hash) | {'layout': layout, 'compression': compression}
+        if all(Manifest(output_file).matches(parameters) for output_file in output_files(job)):
+            print(f'{job[0].__name__}\t{job[1]}\tup to date')
+        else:
+            pending.append(job)
+    if not pending:
+        return
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        # parse once in the parent, the forked workers share its pages instead of parsing the input again
+        context = multiprocessing.get_context('fork')
+        shared_index = SequenceGenerator.load_index(data_file, cache_directory)
+        shared_token_frequency = SequenceGenerator.ingredient_frequency(shared_index)
+    else:
+        context = multiprocessing.get_context('spawn')
+        if cache_directory is not None:
+            # build the cache once, so that every worker only memory maps it
+            SequenceGenerator.load_index(data_file, cache_directory)
+
+    processes = min(processes or os.cpu_count() or 1, len(pending))
+    # every generator owns its random stream, so the output of a job only depends on its own seed
+    with context.Pool(processes, initializer=initialize_worker, initargs=(data_file, cache_directory)) as pool:
+        for name, random_seed, count, count_test, generated, elapsed in pool.imap_unordered(run_job, pending):
+            status = 'generated' if generated else 'up to date'
+            print(f'{name}\t{random_seed}\ttraining {count}\ttest {count_test}\t{status}\t{elapsed:.1f} s')
+
+
+if __name__ == '__main__':
+    file = r'path\to\input\json\file'
+    directory = r'path\to\output\directory'
+    # the parsed input is cached here on the first run and memory mapped on later runs
+    cache_directory = r'path\to\cache\directory'
+    # interrupted jobs resume from the sampling state saved here
+    checkpoint_directory = r'path\to\checkpoint\directory'
+
+    run_all(file, directory, max_count=20, max_jaccard=0.75, cache_directory=cache_directory,
+            checkpoint_directory=checkpoint_directory)
@@ -0,0 +1,53 @@
+from src.SimilarityIndex import JaccardIndex
+
+
+class OrderedSet:
+    """Insertion ordered set, keeps the sampling order for the output and hashes for the lookups."""
+
+    def __init__(self, items=()):
+        self.items = dict.fromkeys(items)
+
+    def add(self, item):
+        self.items[item] = None
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def to_list(self) -> list:
+        return list(self.items)
+
+
+class SamplingState:
+    """Recipe ids, titles and ingredient lists already taken by a sample, passed from the train to the test split."""
+
+    def __init__(self, max_jaccard: float, token_frequency: dict = None):
+        self.max_jaccard = max_jaccard
+        self.token_frequency = token_frequency
+        self.recipe_ids = OrderedSet()
+        self.recipe_titles = OrderedSet()
+        self.recipe_ingredients = []
+        self.ingredient_index = JaccardIndex(max_jaccard, token_frequency)
+
+    def add(self, recipe_id: str, title: str, ingredients: list):
+        self.recipe_ids.add(recipe_id)
+        self.recipe_titles.add(title)
+        self.recipe_ingredients.append(ingredients)
+        self.ingredient_index.add(ingredients)
+
+    def contains_id(self, recipe_id: str) -> bool:
+        return recipe_id in self.recipe_ids
+
+    def contains_title(self, title: str) -> bool:
+        return title in self.recipe_titles
+
+    def too_similar(self, ingredients: list) -> bool:
+        return self.ingredient_index.max_similarity_reaches(ingredients)
+
+    def __len__(self):
+        return len(self.recipe_ids)
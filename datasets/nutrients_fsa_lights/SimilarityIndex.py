@@ -0,0 +1,80 @@
+import math
+
+
+class JaccardIndex:
+    """Inverted ingredient index with prefix filtering for the max_jaccard check.
+
+    Every stored ingredient set is indexed by its prefix under a global token ordering (rarest tokens first).
+    Two sets with a Jaccard similarity of at least the threshold always share a token in their prefixes,
+    so only sets found through the prefix tokens are verified with the exact similarity.
+    """
+
+    def __init__(self, threshold: float, token_frequency: dict = None):
+        self.threshold = threshold
+        self.token_frequency = token_frequency if token_frequency is not None else dict()
+        self.sets = []
+        self.postings = dict()
+        self.empty_count = 0
+
+    @staticmethod
+    def count_tokens(ingredient_lists) -> dict:
+        frequency = dict()
+        for ingredients in ingredient_lists:
+            for token in set(ingredient.lower() for ingredient in ingredients):
+                frequency[token] = frequency.get(token, 0) + 1
+        return frequency
+
+    @staticmethod
+    def jaccard_similarity(set_a: frozenset, set_b: frozenset) -> float:
+        if set_a == set_b:
+            return 1.0
+        return float(len(set_a.intersection(set_b)) / len(set_a.union(set_b)))
+
+    def order(self, tokens: frozenset) -> list:
+        return sorted(tokens, key=lambda token: (self.token_frequency.get(token, 0), token))
+
+    def prefix_length(self, size: int) -> int:
+        # a similar set overlaps in at least ceil(threshold * size) tokens; the small epsilon keeps the prefix
+        # on the safe (longer) side of floating point rounding
+        overlap = math.ceil(self.threshold * size - 1e-9)
+        return min(size, max(1, size - overlap + 1))
+
+    def add(self, ingredients: list):
+        tokens = frozenset(ingredients)
+        set_id = len(self.sets)
+        self.sets.append(tokens)
+        if not tokens:
+            self.empty_count += 1
+            return
+        for token in self.order(tokens)[:self.prefix_length(len(tokens))]:
+            if token not in self.postings:
+                self.postings[token] = [set_id]
+            else:
+                self.postings[token].append(set_id)
+
+    def max_similarity_reaches(self, ingredients: list) -> bool:
+        """Return True if any stored set has a Jaccard similarity of at least the threshold with ingredients."""
+        if self.threshold <= 0.0:
+            return True
+        tokens = frozenset(ingredients)
+        if not tokens:
+            return self.empty_count > 0 and self.threshold <= 1.0
+
+        size = len(tokens)
+        min_size = self.threshold * size
+        max_size = size / self.threshold
+        checked = set()
+        for token in self.order(tokens)[:self.prefix_length(size)]:
+            for set_id in self.postings.get(token, ()):
+                if set_id in checked:
+                    continue
+                checked.add(set_id)
+                candidate = self.sets[set_id]
+                if len(candidate) < min_size - 1e-9 or len(candidate) > max_size + 1e-9:
+                    continue
+                if self.jaccard_similarity(tokens, candidate) >= self.threshold:
+                    return True
+        return False
+
+    def __len__(self):
+        return len(self.sets)
@@ -1,19 +1,80 @@
 import csv
+import gzip
+import io
 
 
 class Writer:
+    """Streams question/answer pairs to a file through a large buffer.
+
+    Questions and answers can be any iterables (e.g. generators), only buffer_size characters are kept in memory.
+    layout='inst' writes the [INST] text files, layout='tsv' writes the instruction/output TSV files that
+    preprocess.py produces from them, so the intermediate text files can be skipped.
+    """
+
+    def __init__(self, buffer_size: int = 1 << 22):
+        self.buffer_size = buffer_size
+
+    def open(self, save_file: str, append: bool, compression: str = None):
+        mode = 'a' if append else 'w'
+        if compression is None:
+            return open(save_file, mode, newline='', encoding='utf-8', buffering=self.buffer_size)
+        elif compression == 'gzip':
+            return gzip.open(save_file, mode + 't', newline='', encoding='utf-8')
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('zstd compression requires the zstandard package')
+            return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(save_file, mode + 'b')),
+                                    newline='', encoding='utf-8')
+        raise ValueError(f'Unknown compression {compression}')
 
     @staticmethod
-    def write(save_file: str, append: bool, questions: list, answers: list):
-        if append:
-            with open(save_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter='\n')
-                for question, answer in zip(questions, answers):
-                    writer.writerow([question])
-                    writer.writerow([answer])
+    def line(text: str) -> str:
+        # the line csv.writer(f, delimiter='\n') writes for a single field, quoted only when needed
+        if text and '"' not in text and '\n' not in text and '\r' not in text:
+            return text
+        buffer = io.StringIO()
+        csv.writer(buffer, delimiter='\n').writerow([text])
+        return buffer.getvalue()[:-2]
+
+    @classmethod
+    def instruction_lines(cls, questions, answers):
+        for question, answer in zip(questions, answers):
+            yield f'{cls.line(question)}\r\n{cls.line(answer)}\r\n'
+
+    @classmethod
+    def tsv_lines(cls, questions, answers):
+        # the same instruction/output pairs preprocess.py reads back from the [INST] text files
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter='\t', lineterminator='\n')
+        for question, answer in zip(questions, answers):
+            instruction = cls.line(question).replace('[INST]', '').replace('[/INST]', '').replace('\t', ' ').strip()
+            writer.writerow([instruction, cls.line(answer).strip()])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def write(self, save_file: str, append: bool, questions, answers, compression: str = None,
+              layout: str = 'inst') -> int:
+        if layout == 'inst':
+            lines = self.instruction_lines(questions, answers)
+        elif layout == 'tsv':
+            lines = self.tsv_lines(questions, answers)
         else:
-            with open(save_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter='\n')
-                for question, answer in zip(questions, answers):
-                    writer.writerow([question])
-                    writer.writerow([answer])
+            raise ValueError(f'Unknown layout {layout}')
+
+        count = 0
+        with self.open(save_file, append, compression) as f:
+            chunk = ['instruction\toutput\n'] if layout == 'tsv' and not append else []
+            size = 0
+            for line in lines:
+                chunk.append(line)
+                size += len(line)
+                count += 1
+                if size >= self.buffer_size:
+                    f.write(''.join(chunk))
+                    chunk = []
+                    size = 0
+            f.write(''.join(chunk))
+        return count
@@ -0,0 +1,127 @@
+import csv
+import sys
+import time
+import tracemalloc
+
+# Streaming parsers of the [INST] ... [/INST] dataset formats. Every function takes an iterable of lines (an open
+# file, a list, another generator) and yields as it goes, so a dataset never has to be read into memory at once:
+#
+# - single line:  [INST] instruction [/INST] output
+# - multi-turn:   [INST] instruction [/INST] output [INST] instruction [/INST] output ...   (NER and NEL)
+# - two lines:    [INST] instruction [/INST]                                              (ingredients, recipes)
+#                 output
+
+START = '[INST]'
+END = '[/INST]'
+
+
+def iter_lines(path):
+    with open(path, 'r', encoding='utf8') as f:
+        yield from f
+
+
+def iter_records(lines):
+    """The prompt of every csv row, as csv.DictReader(f, fieldnames=['prompt'], delimiter='\n') reads them."""
+    for row in csv.DictReader(lines, fieldnames=['prompt'], delimiter='\n'):
+        yield row['prompt']
+
+
+def iter_single_line(lines):
+    """(instruction, output) of every non-empty single line instance, neither part stripped."""
+    for line in lines:
+        if len(line.strip()) > 0:
+            instruction, output = line.replace(START, '').strip().split(END)
+            yield instruction, output
+
+
+def chained_pairs(line):
+    """(instruction, output) of every turn, later turns prefixed with the first output and a </div> separator."""
+    pairs = []
+    chunks = line.split(START)
+    prev_output = ''
+    for idx, chunk in enumerate(chunks):
+        if len(chunk.strip()) > 0:
+            instruction, output = chunk.strip().split(END)
+            if idx > 1:
+                instruction = prev_output + ' </div> ' + instruction
+            pairs.append((instruction.strip(), output.strip()))
+            if idx == 1:
+                prev_output = output
+    return pairs
+
+
+def iter_documents(lines):
+    """The chained pairs of every multi-turn line, an empty list for blank lines so line numbers are kept."""
+    for line in lines:
+        yield chained_pairs(line) if len(line.strip()) > 0 else []
+
+
+def iter_chained(lines):
+    for pairs in iter_documents(lines):
+        yield from pairs
+
+
+def iter_pairs(lines):
+    """(instruction, output) of the two line format, stops at the first instruction without an output."""
+    pair = []
+    for line in lines:
+        if len(line.strip()) > 0:
+            if START in line:
+                pair.append(line.replace(START, '').replace(END, '').replace('\t', ' ').strip())
+            else:
+                pair.append(line.strip())
+                if len(pair) == 2:
+                    yield pair[0], pair[1]
+                    pair = []
+                else:
+                    print('Something is wrong', pair)
+                    return
+
+
+def iter_nel_labels(records, ontology):
+    """(original prompt, answer) of every multi-turn record, the answers are the turns that mention the ontology."""
+    for record in records:
+        if not record.replace(' ', ''):
+            continue
+        prompts = record.split(sep=START)
+        [_, original_prompt] = prompts[1].split(sep=END)
+        for nel_prompt in prompts[2:]:
+            if ontology.lower() in nel_prompt.lower():
+                [_, true_answer] = nel_prompt.split(sep=END)
+                yield original_prompt, true_answer
+
+
+def iter_prompt_answers(records):
+    """(prompt, answer) of csv records, every answer is paired with the last prompt before it."""
+    prompt = None
+    for record in records:
+        if record.startswith(START):
+            prompt = record
+        else:
+            yield prompt, record
+
+
+def benchmark(path, parse):
+    """Lines per second and peak memory of parsing a file with readlines() against streaming it."""
+    results = []
+    for name, lines in [['readlines', lambda: open(path, 'r', encoding='utf8').readlines()],
+                        ['streaming', lambda: iter_lines(path)]]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = sum(1 for _ in parse(lines()))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append([name, count, elapsed, peak])
+    return results
+
+
+if __name__ == '__main__':
+    # python formats.py <format> <file> ..., e.g. the largest NER, NEL bootstrap and recipe files
+    parsers = {'single': iter_single_line, 'chained': iter_chained, 'pairs': iter_pairs}
+    parser_name = sys.argv[1]
+    for path in sys.argv[2:]:
+        line_count = sum(1 for _ in iter_lines(path))
+        for name, count, elapsed, peak in benchmark(path, parsers[parser_name]):
+            print(f'{path}\t{name}\t{count} instances\t{line_count / elapsed:.0f} lines/s\t'
+                  f'peak {peak / 2 ** 20:.1f} MiB')
@@ -5,6 +5,7 @@ from modifiers import NelBaseModifier, FoodOnNelExtendedModifier, HansardNelModi
     SnomedNelExtendedModifier, FsaBaseModifier, FsaExtendedModifier, FsaSynonymModifier, NutrientBaseModifier, \
     NutrientExtendedModifier
 from entities import NelDataset, FsaDataset, NutritionDataset
+from formats import iter_records, iter_nel_labels, iter_prompt_answers
 
 
 class Writer:
@@ -61,16 +62,8 @@ class NerNelPipeline:
 
         for dataset_file in dataset_files:
             with (open(dataset_file, encoding='utf-8') as f):
-                reader = csv.DictReader(f, fieldnames=['prompt'], delimiter='\n')
-                for row in reader:
-                    if not row['prompt'].replace(' ', ''):
-                        continue
-                    prompts = row['prompt'].split(sep='[INST]')
-                    [_, original_prompt] = prompts[1].split(sep='[/INST]')
-                    for nel_prompt in prompts[2:]:
-                        if ontology.lower() in nel_prompt.lower():
-                            [_, true_answer] = nel_prompt.split(sep='[/INST]')
-                            dataset.add_labels(prompt=original_prompt, answer=true_answer)
+                for original_prompt, true_answer in iter_nel_labels(iter_records(f), ontology):
+                    dataset.add_labels(prompt=original_prompt, answer=true_answer)
 
         with (open(input_test_file, encoding='utf-8') as f):
             reader = csv.DictReader(f, delimiter='\t')
@@ -121,16 +114,8 @@ class NelPipeline:
 
         for dataset_file in dataset_files:
             with (open(dataset_file, encoding='utf-8') as f):
-                reader = csv.DictReader(f, fieldnames=['prompt'], delimiter='\n')
-                for row in reader:
-                    if not row['prompt'].replace(' ', ''):
-                        continue
-                    prompts = row['prompt'].split(sep='[INST]')
-                    [_, original_prompt] = prompts[1].split(sep='[/INST]')
-                    for nel_prompt in prompts[2:]:
-                        if ontology.lower() in nel_prompt.lower():
-                            [_, true_answer] = nel_prompt.split(sep='[/INST]')
-                            dataset.add_labels(prompt=original_prompt, answer=true_answer)
+                for original_prompt, true_answer in iter_nel_labels(iter_records(f), ontology):
+                    dataset.add_labels(prompt=original_prompt, answer=true_answer)
 
         with (open(input_test_file, encoding='utf-8') as f):
             reader = csv.DictReader(f, delimiter='\t')
@@ -177,18 +162,8 @@ class FsaPipeline:
                 cleaner = FsaSynonymModifier()
 
         with (open(dataset_file, encoding='utf-8') as f):
-            reader = csv.DictReader(f, fieldnames=['prompt'], delimiter='\n')
-            i = 0
-            j = 0
-            for row in reader:
-                if row['prompt'].startswith('[INST]'):
-                    original_prompt = row['prompt']
-                else:
-                    true_answer = row['prompt']
-                    if i == j:
-                        dataset.add_labels(prompt=original_prompt, answer=true_answer)
-                    i += 1
-                    j += 1
+            for original_prompt, true_answer in iter_prompt_answers(iter_records(f)):
+                dataset.add_labels(prompt=original_prompt, answer=true_answer)
 
         with (open(input_test_file, encoding='utf-8') as f):
             reader = csv.DictReader(f, delimiter='\t')
@@ -230,22 +205,11 @@ class NutritionPipeline:
                 cleaner = NutrientExtendedModifier()
 
         with (open(dataset_file, encoding='utf-8') as f):
-            reader = csv.DictReader(f, fieldnames=['prompt'], delimiter='\n')
-            i = 0
-            j = 0
-            for row in reader:
-                if row['prompt'].startswith('[INST]'):
-                    original_prompt = row['prompt']
-                else:
-                    true_answer = row['prompt']
-                    if i == j:
-                        if i == 0 and j == 0:
-                            true_answer = re.sub('energy - [0-9]+.[0-9]{2}, ', '', true_answer)
-                            dataset.add_labels(prompt=original_prompt, answer=true_answer)
-                            i += 1
-                            j += 1
-                        else:
-                            break
+            # only the first pair is used
+            for original_prompt, true_answer in iter_prompt_answers(iter_records(f)):
+                true_answer = re.sub('energy - [0-9]+.[0-9]{2}, ', '', true_answer)
+                dataset.add_labels(prompt=original_prompt, answer=true_answer)
+                break
 
         with (open(input_test_file, encoding='utf-8') as f):
             reader = csv.DictReader(f, delimiter='\t')
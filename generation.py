@@ -0,0 +1,53 @@
+# Generation settings shared by the training, testing and apply scripts. Every generate call used to run up to 1024
+# new tokens and cut the answers at the end markers afterwards, now the rows stop at the end markers that are special
+# tokens of the model and the number of new tokens is capped by the longest answer of the task in the train sets.
+# Markers of other models are not stop strings: the answers are still cut at them as before, and a model that writes
+# one of them as text would otherwise stop at a different place than it did.
+
+STOP_MARKERS = ['<|eot_id|>', '<|end_of_text|>', '<|im_end|>', '</s>']
+MAX_NEW_TOKENS = 1024
+
+
+def eos_token_ids(tokenizer, generation_config=None):
+    """The eos tokens of the model with the end markers that are special tokens of its tokenizer."""
+    eos_token_id = []
+    for ids in [getattr(generation_config, 'eos_token_id', None), tokenizer.eos_token_id]:
+        for token_id in ids if isinstance(ids, list) else [ids]:
+            if token_id is not None and token_id not in eos_token_id:
+                eos_token_id.append(token_id)
+    special = set(tokenizer.all_special_tokens) | set(tokenizer.get_added_vocab())
+    for marker in STOP_MARKERS:
+        if marker in special:
+            token_id = tokenizer.convert_tokens_to_ids(marker)
+            if token_id not in eos_token_id:
+                eos_token_id.append(token_id)
+    return eos_token_id
+
+
+def max_new_tokens(tokenizer, answers, margin=1.5, slack=32, limit=MAX_NEW_TOKENS):
+    """Tokens of the longest answer times margin plus slack, at most limit."""
+    answers = [str(answer) for answer in answers]
+    if len(answers) == 0:
+        return limit
+    longest = max(len(ids) for ids in tokenizer(answers, add_special_tokens=False)['input_ids'])
+    return min(limit, int(longest * margin) + slack)
+
+
+def task_max_new_tokens(tokenizer, frames, margin=1.5, slack=32, limit=MAX_NEW_TOKENS):
+    """max_new_tokens of every task in train set frames with the task column of their Parquet copies."""
+    answers = {}
+    for df in frames:
+        if 'task' in df.columns:
+            for task, outputs in df.groupby('task')['output']:
+                answers.setdefault(task, []).extend(outputs.tolist())
+    return {task: max_new_tokens(tokenizer, outputs, margin, slack, limit) for task, outputs in answers.items()}
+
+
+def generate_kwargs(tokenizer, generation_config=None, new_tokens=MAX_NEW_TOKENS):
+    """Keyword arguments of model.generate."""
+    return {'max_new_tokens': new_tokens, 'eos_token_id': eos_token_ids(tokenizer, generation_config)}
+
+
+def task_of(df):
+    """The task of a test set read from its Parquet copy, None for TSV files."""
+    return df['task'].iloc[0] if 'task' in df.columns and len(df) > 0 else None
@@ -0,0 +1,69 @@
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, BitsAndBytesConfig
+
+# Base models loaded once per process, with LoRA adapters swapped on top of them. The training and testing scripts
+# used to load the full 4-bit base model in every fold (and setting) of their loops, now they ask the registry for the
+# base model with the adapter of the fold.
+
+
+def load_quantized(base_model):
+    """The 4-bit base model as the training and testing scripts load it."""
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.float16,
+        bnb_4bit_use_double_quant=True,
+    )
+    return AutoModelForCausalLM.from_pretrained(
+        base_model,
+        quantization_config=bnb_config,
+        device_map={"": 0},
+        attn_implementation="eager"
+    )
+
+
+class ModelRegistry:
+    """Every base model is loaded once, with at most one LoRA adapter loaded on top of it.
+
+    load_model(base_model) returns a new model, by default the 4-bit model, a function building a small random model
+    runs the registry on CPU. prepare(model) runs once on every loaded base model and returns the model to keep, e.g.
+    prepare_model_for_kbit_training before training. Adapters are loaded as a PeftModel around the base model and
+    removed again with its unload().
+    """
+
+    def __init__(self, load_model=load_quantized, prepare=None):
+        self.load_model = load_model
+        self.prepare = prepare
+        self.models = {}
+        # base model -> (adapter path, PeftModel) of the loaded adapter, or None
+        self.adapters = {}
+        self.loads = 0
+
+    def base(self, base_model):
+        """The base model without any adapter."""
+        if base_model not in self.models:
+            model = self.load_model(base_model)
+            self.models[base_model] = model if self.prepare is None else self.prepare(model)
+            self.adapters[base_model] = None
+            self.loads += 1
+        if self.adapters[base_model] is not None:
+            self.release(base_model, self.adapters[base_model][1])
+        return self.models[base_model]
+
+    def model(self, base_model, adapter=None):
+        """The base model with the adapter at path adapter loaded, or without any adapter for None."""
+        if adapter is None:
+            return self.base(base_model)
+        loaded = self.adapters.get(base_model)
+        if loaded is not None and loaded[0] == adapter:
+            return loaded[1]
+        model = PeftModel.from_pretrained(self.base(base_model), adapter)
+        self.adapters[base_model] = (adapter, model)
+        return model
+
+    def release(self, base_model, peft_model):
+        """The base model of a PeftModel, with its LoRA layers removed, e.g. after training with get_peft_model."""
+        self.models[base_model] = peft_model.unload()
+        self.adapters[base_model] = None
+        return self.models[base_model]
@@ -0,0 +1,74 @@
+import copy
+
+import torch
+from transformers import DynamicCache
+
+# Few-shot prompts of a test set start with the same tokens: the chat template, the header of add_examples and, with
+# fixed shots, the examples themselves. The KV cache of that prefix is computed once and reused by every batch whose
+# prompts all start with it, so the prefill only runs over the rest of the prompts.
+
+
+class PrefixCache:
+    """KV cache of the token prefix shared by the prompts of a batch, kept while the next batches share it too.
+
+    The rows are laid out as prefix, padding, rest of the prompt (middle padding): the prefix is the same for every
+    row, the padding is masked out by the attention mask, and since the positions are counted over the attention mask
+    the remaining tokens get the same positions as without padding. Batches that share fewer than min_prefix tokens,
+    or with prompts longer than max_length, are not generated here and generate returns None.
+    """
+
+    def __init__(self, model, tokenizer, min_prefix=16):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.min_prefix = min_prefix
+        self.prefix_ids = []
+        self.cache = None
+        self.prefills = 0
+        # prompt tokens of the batches generated here, and those of them read from the cache instead of prefilled
+        self.prompt_tokens = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def common_prefix(rows):
+        prefix = rows[0]
+        for ids in rows[1:]:
+            n = 0
+            while n < min(len(prefix), len(ids)) and prefix[n] == ids[n]:
+                n += 1
+            prefix = prefix[:n]
+        return prefix
+
+    def prefill(self, prefix_ids):
+        with torch.no_grad():
+            outputs = self.model(input_ids=torch.tensor([prefix_ids], device=self.model.device), use_cache=True)
+        cache = outputs.past_key_values
+        self.cache = cache if isinstance(cache, DynamicCache) else DynamicCache.from_legacy_cache(cache)
+        self.prefix_ids = prefix_ids
+        self.prefills += 1
+
+    def generate(self, prompts, max_length, **generate_kwargs):
+        """(generated ids, length of the prompts in them), or None when the batch has to be generated without it."""
+        # tokenized as the test loops tokenize the prompts, every row keeps at least one token after the prefix
+        rows = self.tokenizer(prompts)['input_ids']
+        if max(len(ids) for ids in rows) > max_length:
+            return None
+        shared = self.common_prefix(rows)[:min(len(ids) for ids in rows) - 1]
+        if len(self.prefix_ids) == 0 or shared[:len(self.prefix_ids)] != self.prefix_ids:
+            if len(shared) < self.min_prefix:
+                return None
+            self.prefill(shared)
+        n = len(self.prefix_ids)
+        rests = [ids[n:] for ids in rows]
+        width = max(len(rest) for rest in rests)
+        pad_token_id = self.tokenizer.pad_token_id
+        input_ids = [self.prefix_ids + [pad_token_id] * (width - len(rest)) + rest for rest in rests]
+        attention_mask = [[1] * n + [0] * (width - len(rest)) + [1] * len(rest) for rest in rests]
+        self.prompt_tokens += sum(len(ids) for ids in rows)
+        self.reused_tokens += n * len(rows)
+        # generate extends the cache, the copy keeps the prefix for the next batches
+        cache = copy.deepcopy(self.cache)
+        cache.batch_repeat_interleave(len(rows))
+        generated_ids = self.model.generate(input_ids=torch.tensor(input_ids, device=self.model.device),
+                                            attention_mask=torch.tensor(attention_mask, device=self.model.device),
+                                            past_key_values=cache, **generate_kwargs)
+        return generated_ids, n + width
@@ -1,10 +1,27 @@
 import pandas as pd
+import numpy as np
 import os
+import argparse
+import time
+import split_store
+from evaluation import formats
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from sklearn.model_selection import KFold
 
 
 TRAIN_SET_PATH = 'train_sets_all_data'
 TEST_SET_PATH = 'test_sets_all_data'
+SPLIT_STORE_PATH = 'split_store'
+
+NER_DATASETS = ['datasets/NER and NEL/CafeteriaFCD_instruction_response.txt',
+                'datasets/NER and NEL/CafeteriaSA_instruction_response.txt']
+NEL_BOOTSTRAP_DATASETS = ['datasets/NEL bootstrap samples/FCD_foodon_instruction_response.txt',
+                          'datasets/NEL bootstrap samples/FCD_hansard_instruction_response.txt',
+                          'datasets/NEL bootstrap samples/FCD_snomed_ct_instruction_response.txt']
+USDA_FCD_AND_CONVERSION_DATASETS = [['datasets/USDA FCD mapping (synonims)/USDA_mapping.txt', 'usda_mapping'],
+                                    ['datasets/Unit conversion/conversion_new.txt', 'conversion']]
+INGREDIENT_TRAIN_DATASETS = ['datasets/ingredients/ingredient_nutrient_value_training.txt']
+INGREDIENT_TEST_DATASETS = ['datasets/ingredients/ingredient_nutrient_value_test.txt']
 
 
 
@@ -21,92 +38,63 @@ def cv_split(df, output_name):
         test_df.to_csv(TEST_SET_PATH + '/' + f'split_{idx}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
 
 
+# The source files are streamed line by line by the parsers in evaluation/formats.py, the evaluation pipelines read
+# the same formats with them.
+
+def read_nel_bootstrap(ds):
+    dataset = [(instruction.replace(' ?', '?').strip(), output.strip())
+               for instruction, output in formats.iter_single_line(formats.iter_lines(ds))]
+    return pd.DataFrame(dataset, columns=['instruction', 'output'])
+
+
+def read_USDA_FCD_and_conversion(ds_path):
+    dataset = [(instruction.replace('\t', ' ').replace(' ?', '?').replace('"', '').strip(),
+                output.replace('\t', ' ').replace('"', '').strip())
+               for instruction, output in formats.iter_single_line(formats.iter_lines(ds_path))]
+    return pd.DataFrame(dataset, columns=['instruction', 'output'])
+
+
+def read_instruction_pairs(ds):
+    return pd.DataFrame(list(formats.iter_pairs(formats.iter_lines(ds))), columns=['instruction', 'output'])
+
+
 def preprocess_ner():
-    datasets = ['datasets/NER and NEL/CafeteriaFCD_instruction_response.txt',
-                'datasets/NER and NEL/CafeteriaSA_instruction_response.txt']
+    datasets = NER_DATASETS
     for dt_path in datasets:
         output_name = dt_path.split('/')[-1].replace(' ', '_').split('.')[0]
         kf = KFold(n_splits=5, shuffle=True, random_state=123)
-        with open(dt_path, 'r', encoding='utf8') as f:
-            df = pd.DataFrame(f.readlines(), columns=['text'])
-            for cv_idx, split in enumerate(kf.split(df)):
-                train_df = df.iloc[split[0]]
-                test_df = df.iloc[split[1]]
-                if not os.path.exists(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/'):
-                    os.makedirs(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/')
-                if not os.path.exists(TEST_SET_PATH + '/' + f'split_{cv_idx}/'):
-                    os.makedirs(TEST_SET_PATH + '/' + f'split_{cv_idx}/')
-
-                counter = 0
-                train_dataset = []
-                for line in train_df['text'].tolist():
-                    if len(line.strip()) > 0:
-                        chunks = line.split('[INST]')
-                        counter += 1
-                        prev_output = ''
-                        for idx, chunk in enumerate(chunks):
-                            if len(chunk.strip()) > 0:
-                                instruction, output = chunk.strip().split('[/INST]')
-                                if idx > 1:
-                                    instruction = prev_output + ' </div> ' + instruction
-                                train_dataset.append((instruction.strip(), output.strip()))
-                                if idx == 1:
-                                    prev_output = output
-                test_dataset = []
-                for line in test_df['text'].tolist():
-                    if len(line.strip()) > 0:
-                        chunks = line.split('[INST]')
-                        counter += 1
-                        prev_output = ''
-                        for idx, chunk in enumerate(chunks):
-                            if len(chunk.strip()) > 0:
-                                instruction, output = chunk.strip().split('[/INST]')
-                                if idx > 1:
-                                    instruction = prev_output + ' </div> ' + instruction
-                                test_dataset.append((instruction.strip(), output.strip()))
-                                if idx == 1:
-                                    prev_output = output
-                train_df = pd.DataFrame(train_dataset, columns=['instruction', 'output'])
-                train_df = train_df.sample(frac=1, random_state=123).reset_index(drop=True)
-                train_df.to_csv(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
-                test_df = pd.DataFrame(test_dataset, columns=['instruction', 'output'])
-                test_df.to_csv(TEST_SET_PATH + '/' + f'split_{cv_idx}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
+        # the chained pairs of every line, the folds are split by line
+        documents = list(formats.iter_documents(formats.iter_lines(dt_path)))
+        for cv_idx, split in enumerate(kf.split(np.arange(len(documents)))):
+            if not os.path.exists(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/'):
+                os.makedirs(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/')
+            if not os.path.exists(TEST_SET_PATH + '/' + f'split_{cv_idx}/'):
+                os.makedirs(TEST_SET_PATH + '/' + f'split_{cv_idx}/')
+
+            train_dataset = [pair for i in split[0] for pair in documents[i]]
+            test_dataset = [pair for i in split[1] for pair in documents[i]]
+            train_df = pd.DataFrame(train_dataset, columns=['instruction', 'output'])
+            train_df = train_df.sample(frac=1, random_state=123).reset_index(drop=True)
+            train_df.to_csv(TRAIN_SET_PATH + '/' + f'split_{cv_idx}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
+            test_df = pd.DataFrame(test_dataset, columns=['instruction', 'output'])
+            test_df.to_csv(TEST_SET_PATH + '/' + f'split_{cv_idx}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
 
 
 def preprocess_nel_bootstrap():
-    datasets = ['datasets/NEL bootstrap samples/FCD_foodon_instruction_response.txt',
-                'datasets/NEL bootstrap samples/FCD_hansard_instruction_response.txt',
-                'datasets/NEL bootstrap samples/FCD_snomed_ct_instruction_response.txt']
+    datasets = NEL_BOOTSTRAP_DATASETS
 
     for ds in datasets:
-        dataset = []
         output_name = ds.split('/')[-1].replace(' ', '_').split('.')[0]
-        with open(ds, 'r', encoding='utf8') as f:
-            docs = f.readlines()
-            for line in docs:
-                if len(line.strip()) > 0:
-                    line = line.replace('[INST]', '')
-                    instruction, output = line.strip().split('[/INST]')
-                    dataset.append((instruction.replace(' ?', '?').strip(), output.strip()))
-        df = pd.DataFrame(dataset, columns=['instruction', 'output'])
+        df = read_nel_bootstrap(ds)
         cv_split(df, output_name)
 
 
 
 def preprocess_USDA_FCD_and_conversion():
-    datasets = [['datasets/USDA FCD mapping (synonims)/USDA_mapping.txt', 'usda_mapping'],
-                ['datasets/Unit conversion/conversion_new.txt', 'conversion']]
+    datasets = USDA_FCD_AND_CONVERSION_DATASETS
     for ds in datasets:
         ds_path, ds_name = ds[0], ds[1]
-        with open(ds_path, 'r', encoding='utf8') as f:
-            docs = f.readlines()
-            dataset = []
-            for line in docs:
-                if len(line.strip()) > 0:
-                    line = line.replace('[INST]', '').replace('\t', ' ')
-                    instruction, output = line.strip().split('[/INST]')
-                    dataset.append((instruction.replace(' ?', '?').replace('"', '').strip(), output.replace('"', '').strip()))
-        df = pd.DataFrame(dataset, columns=['instruction', 'output'])
+        df = read_USDA_FCD_and_conversion(ds_path)
         for fold in range(5):
             if not os.path.exists(TRAIN_SET_PATH + '/' + f'split_{fold}/'):
                 os.makedirs(TRAIN_SET_PATH + '/' + f'split_{fold}/')
@@ -114,44 +102,28 @@ def preprocess_USDA_FCD_and_conversion():
 
 
 def preprocess_ingredients():
-    train_datasets = ['datasets/ingredients/ingredient_nutrient_value_training.txt']
-    test_datasets = ['datasets/ingredients/ingredient_nutrient_value_test.txt']
+    train_datasets = INGREDIENT_TRAIN_DATASETS
+    test_datasets = INGREDIENT_TEST_DATASETS
 
     all_datasets = [train_datasets, test_datasets]
     for idx, dss in enumerate(all_datasets):
         for ds in dss:
             output_name = " ".join(ds.split('/')[1:]).replace(' ', '_').lower().split('.')[0]
+            # the file is the same for every fold, it is read once and written to each of them
+            df = read_instruction_pairs(ds)
             for fold in range(5):
-                with open(ds, 'r', encoding='utf8') as f:
-                    docs = f.readlines()
-                    dataset = []
-                    pair = []
-                    for line in docs:
-                        if len(line.strip()) > 0:
-                            if '[INST]' in line:
-                                inst = line.replace('[INST]', '').replace('[/INST]', '').replace('\t', ' ').strip()
-                                pair.append(inst)
-                            else:
-                                output = line.strip()
-                                pair.append(output)
-                                if len(pair) == 2:
-                                    dataset.append((pair[0], pair[1]))
-                                    pair = []
-                                else:
-                                    print('Something is wrong', pair)
-                                    break
-                df = pd.DataFrame(dataset, columns=['instruction', 'output'])
                 if idx == 0:
                     df.to_csv(TRAIN_SET_PATH + '/' + f'split_{fold}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
                 elif idx == 1:
                     df.to_csv(TEST_SET_PATH + '/' + f'split_{fold}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
 
 
-def preprocess_recipes():
+def recipe_datasets():
     fsa_ingredients_seeds = ['120459', '228727', '398065', '537363', '638908']
     fsa_title_ingredients_seeds = ['150769', '359225', '476390', '755236', '812461']
     nutrient_ingredients_seeds = ['107473', '234053', '442417', '619176', '777572']
     nutrient_title_ingredients_seeds = ['206184', '384578', '512894', '638165', '767065']
+    datasets = []
     for fold, seeds in enumerate(zip(fsa_ingredients_seeds, fsa_title_ingredients_seeds, nutrient_ingredients_seeds, nutrient_title_ingredients_seeds)):
         train_datasets = [f'datasets/recipes/fsa lights/ingredients/{seeds[0]}/dataset_training_20_{seeds[0]}.txt',
                           f'datasets/recipes/fsa lights/title and ingredients/{seeds[1]}/dataset_training_20_{seeds[1]}.txt',
@@ -164,30 +136,17 @@ def preprocess_recipes():
                          f'datasets/recipes/nutrient values/ingredients/{seeds[2]}/dataset_test_20_{seeds[2]}.txt',
                          f'datasets/recipes/nutrient values/title and ingredients/{seeds[3]}/dataset_test_20_{seeds[3]}.txt',
         ]
+        datasets.append((fold, train_datasets, test_datasets))
+    return datasets
+
 
+def preprocess_recipes():
+    for fold, train_datasets, test_datasets in recipe_datasets():
         all_datasets = [train_datasets, test_datasets]
         for idx, dss in enumerate(all_datasets):
             for ds in dss:
                 output_name = " ".join(ds.split('/')[1:]).replace(' ', '_').lower().split('.')[0]
-                with open(ds, 'r', encoding='utf8') as f:
-                    docs = f.readlines()
-                    dataset = []
-                    pair = []
-                    for line in docs:
-                        if len(line.strip()) > 0:
-                            if '[INST]' in line:
-                                inst = line.replace('[INST]', '').replace('[/INST]', '').replace('\t', ' ').strip()
-                                pair.append(inst)
-                            else:
-                                output = line.strip()
-                                pair.append(output)
-                                if len(pair) == 2:
-                                    dataset.append((pair[0], pair[1]))
-                                    pair = []
-                                else:
-                                    print('Something is wrong', pair)
-                                    break
-                df = pd.DataFrame(dataset, columns=['instruction', 'output'])
+                df = read_instruction_pairs(ds)
                 if idx == 0:
                     df.to_csv(TRAIN_SET_PATH + '/' + f'split_{fold}/' + output_name + '.tsv', encoding='utf8', index=False, sep='\t')
                 elif idx == 1:
@@ -195,12 +154,158 @@ def preprocess_recipes():
 
 
 
-if __name__ == '__main__':
+# Task graph version of the functions above: every source file is parsed once by a parse task, which returns the
+# rows of each fold output. Those are either written as TSV copies by write tasks, or stored once in the split store
+# with per-fold row indexes (see split_store.py). All tasks run in a pool of worker processes, the TSV outputs are
+# the same as above, and every TSV file gets a Parquet copy with the task and word count columns.
+
+def write_tsv(df, set_path, fold, output_name):
+    os.makedirs(set_path + '/' + f'split_{fold}/', exist_ok=True)
+    tsv_path = set_path + '/' + f'split_{fold}/' + output_name + '.tsv'
+    df.to_csv(tsv_path, encoding='utf8', index=False, sep='\t')
+    # the Parquet copy the training and testing scripts read instead of the TSV file
+    split_store.write_table(tsv_path, df)
+
+
+def write_tsv_rows(df, set_path, fold, output_name, rows):
+    write_tsv(df if rows is None else df.iloc[rows], set_path, fold, output_name)
+
+
+def parse_ner(dt_path):
+    output_name = dt_path.split('/')[-1].replace(' ', '_').split('.')[0]
+    kf = KFold(n_splits=5, shuffle=True, random_state=123)
+    line_pairs = list(formats.iter_documents(formats.iter_lines(dt_path)))
+    df = pd.DataFrame([pair for pairs in line_pairs for pair in pairs], columns=['instruction', 'output'])
+    # rows of the pairs of every line in df
+    line_rows = np.split(np.arange(len(df)), np.cumsum([len(pairs) for pairs in line_pairs])[:-1])
+
+    outputs = []
+    for cv_idx, split in enumerate(kf.split(np.arange(len(line_pairs)))):
+        train_rows = np.concatenate([line_rows[i] for i in split[0]] + [np.zeros(0, dtype=int)])
+        test_rows = np.concatenate([line_rows[i] for i in split[1]] + [np.zeros(0, dtype=int)])
+        # the training pairs are shuffled as in preprocess_ner, the permutation only depends on the row count
+        permutation = pd.DataFrame(index=range(len(train_rows))).sample(frac=1, random_state=123).index.to_numpy()
+        outputs.append((TRAIN_SET_PATH, cv_idx, train_rows[permutation]))
+        outputs.append((TEST_SET_PATH, cv_idx, test_rows))
+    return output_name, df, outputs
+
+
+def parse_nel_bootstrap(ds):
+    output_name = ds.split('/')[-1].replace(' ', '_').split('.')[0]
+    df = read_nel_bootstrap(ds)
+    kf = KFold(n_splits=5, shuffle=True, random_state=123)
+    outputs = []
+    for idx, split in enumerate(kf.split(df)):
+        outputs.append((TRAIN_SET_PATH, idx, split[0]))
+        outputs.append((TEST_SET_PATH, idx, split[1]))
+    return output_name, df, outputs
+
+
+def parse_USDA_FCD_and_conversion(ds_path, ds_name):
+    df = read_USDA_FCD_and_conversion(ds_path)
+    return ds_name, df, [(TRAIN_SET_PATH, fold, None) for fold in range(5)]
+
+
+def parse_instruction_pairs(ds, set_path, folds):
+    output_name = " ".join(ds.split('/')[1:]).replace(' ', '_').lower().split('.')[0]
+    df = read_instruction_pairs(ds)
+    return output_name, df, [(set_path, fold, None) for fold in folds]
+
+
+def preprocessing_tasks():
+    tasks = [(parse_ner, (dt_path,)) for dt_path in NER_DATASETS]
+    tasks += [(parse_nel_bootstrap, (ds,)) for ds in NEL_BOOTSTRAP_DATASETS]
+    tasks += [(parse_USDA_FCD_and_conversion, (ds_path, ds_name))
+              for ds_path, ds_name in USDA_FCD_AND_CONVERSION_DATASETS]
+    # the ingredient files are the same for every fold, they are read once instead of once per fold
+    tasks += [(parse_instruction_pairs, (ds, TRAIN_SET_PATH, range(5))) for ds in INGREDIENT_TRAIN_DATASETS]
+    tasks += [(parse_instruction_pairs, (ds, TEST_SET_PATH, range(5))) for ds in INGREDIENT_TEST_DATASETS]
+    for fold, train_datasets, test_datasets in recipe_datasets():
+        tasks += [(parse_instruction_pairs, (ds, TRAIN_SET_PATH, [fold])) for ds in train_datasets]
+        tasks += [(parse_instruction_pairs, (ds, TEST_SET_PATH, [fold])) for ds in test_datasets]
+    return tasks
+
+
+def store_outputs(output_name, df, outputs):
+    split_store.write_source(SPLIT_STORE_PATH, output_name, df)
+    for set_path, fold, rows in outputs:
+        split_store.write_rows(SPLIT_STORE_PATH, fold, split_store.part(set_path, TRAIN_SET_PATH), output_name,
+                               np.arange(len(df)) if rows is None else rows)
+
+
+def run_task(function, args, output_format='tsv'):
+    start = time.perf_counter()
+    result = function(*args)
+    tasks = []
+    if result is not None:
+        output_name, df, outputs = result
+        if output_format == 'tsv':
+            tasks = [(write_tsv_rows, (df, set_path, fold, output_name, rows)) for set_path, fold, rows in outputs]
+        else:
+            # the source is stored once, every fold only adds its row indexes
+            store_outputs(output_name, df, outputs)
+    return tasks, time.perf_counter() - start
+
+
+def preprocess_parallel(jobs, output_format='tsv'):
+    """Runs the parse tasks and then the write tasks they return, jobs worker processes at a time."""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        running = {executor.submit(run_task, function, args, output_format): function.__name__
+                   for function, args in preprocessing_tasks()}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                tasks, elapsed = future.result()
+                print(f'{name}: {elapsed:.2f} s')
+                for function, args in tasks:
+                    running[executor.submit(run_task, function, args, output_format)] = function.__name__
+
+
+def write_tables(set_path):
+    """Parquet copies of the TSV files the sequential functions wrote, as write_tsv adds them to its TSV files."""
+    for fold in sorted(os.listdir(set_path)):
+        folder = os.path.join(set_path, fold)
+        if not os.path.isdir(folder):
+            continue
+        for f in sorted(os.listdir(folder)):
+            if f.endswith('.tsv'):
+                tsv_path = os.path.join(folder, f)
+                split_store.write_table(tsv_path, split_store.read_tsv(tsv_path))
+
+
+def preprocess_sequential():
     preprocess_ner()
     preprocess_nel_bootstrap()
     preprocess_USDA_FCD_and_conversion()
     preprocess_ingredients()
     preprocess_recipes()
+    write_tables(TRAIN_SET_PATH)
+    write_tables(TEST_SET_PATH)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes, 0 runs the original sequential functions')
+    parser.add_argument('--format', choices=['tsv', 'index'], default='tsv',
+                        help='tsv writes a copy of every fold, index stores every source once with per-fold row indexes')
+    parser.add_argument('--compare', action='store_true',
+                        help='also run the sequential functions and print both wall-clock times')
+    args = parser.parse_args()
+
+    timings = []
+    if args.jobs == 0 or args.compare:
+        start = time.perf_counter()
+        preprocess_sequential()
+        timings.append(('sequential', time.perf_counter() - start))
+    if args.jobs > 0:
+        start = time.perf_counter()
+        preprocess_parallel(args.jobs, args.format)
+        timings.append((f'parallel, {args.jobs} jobs, {args.format}', time.perf_counter() - start))
+    for name, elapsed in timings:
+        print(f'{name}: {elapsed:.2f} s wall-clock')
 
 
 
@@ -0,0 +1,107 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+# Fold splits stored as index files: every source dataset is written once as Parquet and every fold output only as
+# the array of its row indexes into the source, instead of a full TSV copy per fold.
+#
+#   <store>/sources/<name>.parquet
+#   <store>/split_<fold>/<train|test>/<name>.npy
+
+
+def part(set_path, train_set_path):
+    return 'train' if set_path == train_set_path else 'test'
+
+
+def write_source(store_path, name, df):
+    os.makedirs(os.path.join(store_path, 'sources'), exist_ok=True)
+    df.to_parquet(os.path.join(store_path, 'sources', name + '.parquet'), index=False)
+
+
+def write_rows(store_path, fold, part_name, name, rows):
+    folder = os.path.join(store_path, f'split_{fold}', part_name)
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, name + '.npy'), np.asarray(rows, dtype=np.int64))
+
+
+def list_datasets(store_path, fold, part_name):
+    folder = os.path.join(store_path, fold if str(fold).startswith('split_') else f'split_{fold}', part_name)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f[:-len('.npy')] for f in os.listdir(folder) if f.endswith('.npy'))
+
+
+@functools.lru_cache(maxsize=8)
+def load_source(store_path, name):
+    return pd.read_parquet(os.path.join(store_path, 'sources', name + '.parquet'))
+
+
+def load_dataset(store_path, fold, part_name, name):
+    """The DataFrame of one fold output, as preprocess.py wrote it to the TSV file of that fold."""
+    folder = os.path.join(store_path, fold if str(fold).startswith('split_') else f'split_{fold}', part_name)
+    rows = np.load(os.path.join(folder, name + '.npy'), mmap_mode='r')
+    return load_source(store_path, name).iloc[rows].reset_index(drop=True)
+
+
+def load_datasets(store_path, fold, part_name):
+    """Yields (name, DataFrame) for every dataset of a fold, each source is only read when it is first needed."""
+    for name in list_datasets(store_path, fold, part_name):
+        yield name, load_dataset(store_path, fold, part_name, name)
+
+
+# Parquet copies of the fold TSV files, written next to them by preprocess.py with two precomputed columns: the task
+# of the dataset and the whitespace word count of every pair, the length measure concat_all filters the mosaic data
+# with. The readers below prefer them over the TSV files and return the same frame from either file: text columns
+# as strings, with empty cells as '' instead of NaN.
+
+TABLE_COLUMNS = ['task', 'words']
+
+
+def task_type(output_name):
+    if output_name.startswith('Cafeteria'):
+        return 'ner'
+    if output_name.startswith('FCD_'):
+        return 'nel'
+    if output_name.startswith('ingredients_'):
+        return 'ingredients'
+    if output_name.startswith('recipes_fsa_lights_'):
+        return 'fsa'
+    if output_name.startswith('recipes_nutrient_values_'):
+        return 'nutrients'
+    return output_name
+
+
+def as_text(values):
+    # as the TSV file stores them: None and NaN are empty cells, other values their text
+    return values.where(values.notna(), '').astype(str)
+
+
+def with_columns(df, task):
+    words = as_text(df['instruction']).str.split().str.len() + as_text(df['output']).str.split().str.len()
+    return df.assign(task=task, words=words.astype(np.int32))
+
+
+def write_table(tsv_path, df, task=None):
+    if task is None:
+        task = task_type(os.path.basename(tsv_path)[:-len('.tsv')])
+    with_columns(df, task).to_parquet(tsv_path[:-len('.tsv')] + '.parquet', index=False)
+
+
+def read_tsv(tsv_path):
+    return pd.read_csv(tsv_path, encoding='utf8', sep='\t', dtype=str, keep_default_na=False)
+
+
+def read_table(tsv_path, columns=None):
+    """The fold file at tsv_path, read from its Parquet copy unless the TSV file was written after it."""
+    parquet_path = tsv_path[:-len('.tsv')] + '.parquet'
+    if os.path.isfile(parquet_path) and \
+            (not os.path.isfile(tsv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(tsv_path)):
+        df = pd.read_parquet(parquet_path, columns=columns)
+        for column in df.columns:
+            if column not in TABLE_COLUMNS:
+                df[column] = as_text(df[column])
+        return df
+    df = with_columns(read_tsv(tsv_path), task_type(os.path.basename(tsv_path)[:-len('.tsv')]))
+    return df if columns is None else df[columns]
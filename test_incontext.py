@@ -1,12 +1,17 @@
 import pandas as pd
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoTokenizer
 import os, torch
 import editdistance
+import split_store
+from model_registry import ModelRegistry
+import batching
+import generation
+from prefix_cache import PrefixCache
 
 #this function assumes that the train and test set data have been created using the preprocess.py function
 def get_train_path(test_set_folder, test_set_file):
     train_set_folder = test_set_folder.replace('test', 'train')
-    all_files = os.listdir(train_set_folder)
+    all_files = [f for f in os.listdir(train_set_folder) if f.endswith('.tsv')]
     min_dist = 1000000
     target_file = ""
     for f in all_files:
@@ -15,10 +20,12 @@ def get_train_path(test_set_folder, test_set_file):
             target_file = f
             min_dist = dist
     target_file_path = os.path.join(train_set_folder, target_file)
-    df = pd.read_csv(target_file_path, sep='\t')
+    df = split_store.read_table(target_file_path)
     return df
 
-def add_examples(df_sample_dataset, user_prompt, setting, div):
+def add_examples(df_sample_dataset, user_prompt, setting, div, fixed_shots=None):
+    # with a fixed_shots dict every question of a kind gets the same examples, sampled the first time the kind is seen,
+    # so the prompts share their whole examples prefix and its KV cache is reused (see prefix_cache.py)
     prompt = f"The following are examples of questions (with answers) about nutrition.\n\n"
 
     # Create few-shot prompts
@@ -37,7 +44,13 @@ def add_examples(df_sample_dataset, user_prompt, setting, div):
     else:
         df_sample_dataset = df_sample_dataset[df_sample_dataset['instruction'].str.contains("</div>")==False]
 
-    df_sample = df_sample_dataset.sample(n=n)
+    key = (n, div, 'FoodOn ontology' in user_prompt, 'SNOMEDCT ontology' in user_prompt, 'Hansard taxonomy' in user_prompt)
+    if fixed_shots is not None and key in fixed_shots:
+        df_sample = fixed_shots[key]
+    else:
+        df_sample = df_sample_dataset.sample(n=n)
+        if fixed_shots is not None:
+            fixed_shots[key] = df_sample
     df_sample["sample"] = df_sample.apply(lambda x: "Question: " + x["instruction"] + '\nAnswer: ' + x['output'], axis=1)
     for idx, row in df_sample.iterrows():
         prompt += row['sample'] + '\n\n'
@@ -53,30 +66,31 @@ if __name__ == '__main__':
     base_model = "meta-llama/Meta-Llama-3-8B-Instruct"
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     settings = ['zero-shot', 'one-shot', 'five-shot']
+    # caps the new tokens of the answers by the longest answer of the train set, which shortens verbose answers and
+    # changes the scores compared with the published results
+    cap_new_tokens = False
     folds = ['split_0', 'split_1', 'split_2', 'split_3', 'split_4']
     test_batch = 16
+    # the few-shot examples are sampled once per test set and kind of question instead of for every question, which
+    # makes the whole examples part of the prompts a shared prefix (the results differ from the random examples)
+    use_fixed_shots = False
+    # the KV cache of the prompt prefix shared by a batch is computed once and reused by the next batches sharing it.
+    # With random examples only the chat template and the examples header are shared, too little to pay for copying
+    # the cache, so it is only used with fixed shots
+    prefix_caching = use_fixed_shots
+    # the base model is loaded once for all settings and folds
+    registry = ModelRegistry()
     for setting in settings:
         for fold in folds:
             # Loading a dataset
             print('Fold: ', fold)
             test_folder = os.path.join(TEST_SET_PATH, fold)
 
-            bnb_config = BitsAndBytesConfig(
-                load_in_4bit=True,
-                bnb_4bit_quant_type="nf4",
-                bnb_4bit_compute_dtype=torch.float16,
-                bnb_4bit_use_double_quant=True,
-            )
-
-            model = AutoModelForCausalLM.from_pretrained(
-                base_model,
-                quantization_config=bnb_config,
-                device_map={"": 0},
-                attn_implementation="eager"
-            )
+            model = registry.model(base_model)
 
             tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
             tokenizer.pad_token = tokenizer.eos_token
+            prefix_cache = PrefixCache(model, tokenizer) if prefix_caching else None
 
             def format_chat_template(row):
                 row_json = [{"role": "user", "content": row["instruction"]},
@@ -87,66 +101,89 @@ if __name__ == '__main__':
 
             model.config.use_cache = True
             model.eval()
-            all_datasets = os.listdir(test_folder)
+            all_datasets = [f for f in os.listdir(test_folder) if f.endswith('.tsv')]
             for td in all_datasets:
                 all_data = []
                 if '_combined.tsv' not in td:
                     print('Testing on ', td)
                     df_sample_dataset = get_train_path(test_folder, td)
-                    if 'ner' not in td:
-                        current_batch = test_batch
-                    else:
-                        current_batch = 1
-                    df = pd.read_csv(os.path.join(test_folder, td), encoding='utf8', sep='\t')
-                    prev_answer = ""
-                    for i in range(0, len(df), current_batch):
-                        if i % (current_batch * 10) == 0:
-                            print('Generating example', i)
-                        examples = df[i:i + current_batch]
-                        tokenizer_input = []
-                        true_outputs = []
-                        for true_output in examples['output']:
-                            true_outputs.append(true_output)
-                        original_prompts = []
-                        true_prompts = []
-                        for user_prompt in examples['instruction']:
-                            original_prompts.append(user_prompt)
-                            # print("List of instructions: ", all_questions)
-                            system_prompt = ''
-                            get_answer = False
-                            if not '</div>' in user_prompt:
-                                div = False
-                                if setting in ['one-shot', 'five-shot']:
-                                    user_prompt = add_examples(df_sample_dataset, user_prompt, setting, div)
-                                get_answer = True
+                    current_batch = test_batch
+                    fixed_shots = {} if use_fixed_shots else None
+                    df = split_store.read_table(os.path.join(test_folder, td))
+                    # base models answer in their own words, they get MAX_NEW_TOKENS as in the published runs, or with
+                    # cap_new_tokens three times the longest answer of the train set
+                    new_tokens = generation.max_new_tokens(tokenizer, df_sample_dataset['output'], margin=3) if cap_new_tokens \
+                        else generation.MAX_NEW_TOKENS
+                    generate_kwargs = generation.generate_kwargs(tokenizer, model.generation_config, new_tokens)
+                    print('max_new_tokens', generate_kwargs['max_new_tokens'])
+                    # the prompt a row is generated from, with the answer of the first turn it continues
+                    def format_prompt(user_prompt, prev_answer):
+                        system_prompt = ''
+                        if not '</div>' in user_prompt:
+                            div = False
+                            if setting in ['one-shot', 'five-shot']:
+                                user_prompt = add_examples(df_sample_dataset, user_prompt, setting, div, fixed_shots)
+                        else:
+                            div = True
+                            _, question = user_prompt.split("</div>")
+                            if setting in ['one-shot', 'five-shot']:
+                                user_prompt = add_examples(df_sample_dataset, prev_answer.strip() + " " + question.strip(), setting, div, fixed_shots)
+
+                        messages = [
+                            {
+                                "role": "user",
+                                "content": f"{system_prompt} {user_prompt}".strip()
+                            }
+                        ]
+                        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                        return prompt
+
+                    # the first turns of all documents are generated in one wave and the turns continuing their answers (</div>)
+                    # in a second one. The prompts of a wave are built before batching, so the rows are sorted by the token length
+                    # of the prompt they are generated from and batched under a token budget with the same worst case as
+                    # 2048 token prompts in batches of current_batch
+                    parents = batching.chain_parents(df['instruction'].tolist())
+                    batches = []
+                    answers_by_row = {}
+                    throughput = batching.Throughput()
+                    for wave in batching.dependency_waves(parents):
+                        prompts = {row: format_prompt(df['instruction'].iloc[row], answers_by_row.get(parents[row], "")) for row in wave}
+                        lengths = batching.token_lengths(tokenizer, [prompts[row] for row in wave], max_length=2048)
+                        wave_batches = batching.wave_batches(wave, lengths, current_batch * (2048 + 1024), reserved=generate_kwargs['max_new_tokens'],
+                                                             max_rows=2 * current_batch)
+                        batches += wave_batches
+                        for n, batch in enumerate(wave_batches):
+                            if n % 10 == 0:
+                                print('Generating batch', n, 'of', len(wave_batches))
+                            examples = df.iloc[batch]
+                            tokenizer_input = [prompts[row] for row in batch]
+                            true_outputs = examples['output'].tolist()
+                            original_prompts = examples['instruction'].tolist()
+
+                            cached = prefix_cache.generate(tokenizer_input, 2048, do_sample=True, **generate_kwargs) if prefix_cache else None
+                            if cached is not None:
+                                generated_ids, prompt_length = cached
                             else:
-                                div = True
-                                _, question = user_prompt.split("</div>")
-                                if setting in ['one-shot', 'five-shot']:
-                                    user_prompt = add_examples(df_sample_dataset, prev_answer.strip() + " " + question.strip(), setting, div)
-
-                            messages = [
-                                {
-                                    "role": "user",
-                                    "content": f"{system_prompt} {user_prompt}".strip()
-                                }
-                            ]
-                            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                            tokenizer_input.append(prompt)
-
-                        inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=2048).to(device)
-                        generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
-                        answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
-                        answers = [(" ".join((x.split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0].split())).strip() for x in answers]
-                        if get_answer:
-                            prev_answer = answers[0]
-
-                        tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
-
-                        original_prompts = [x.strip() for x in original_prompts]
-                        batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
-                        all_data.extend(batched_examples)
-
+                                inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=2048).to(device)
+                                generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
+                                prompt_length = inputs['input_ids'].shape[1]
+                            throughput.add(generated_ids, prompt_length, generate_kwargs['eos_token_id'])
+                            answers = tokenizer.batch_decode(generated_ids[:, prompt_length:])
+                            answers = [(" ".join((x.split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0].split())).strip() for x in answers]
+                            answers_by_row.update(zip(batch, answers))
+
+                            tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
+
+                            original_prompts = [x.strip() for x in original_prompts]
+                            batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
+                            all_data.extend(batched_examples)
+
+                    # back to the order of the test set
+                    all_data = batching.restore_order(batches, all_data)
+                    throughput.report(td)
+                    if prefix_cache:
+                        print('Prefix cache prefills', prefix_cache.prefills, 'prompt tokens read from the cache', prefix_cache.reused_tokens,
+                              'of', prefix_cache.prompt_tokens)
                     df = pd.DataFrame(all_data, columns=['Original prompt', 'True prompt', 'Answer', 'True'])
                     if not os.path.exists("results/" + setting ):
                         os.makedirs("results/" + setting)
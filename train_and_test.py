@@ -1,43 +1,122 @@
 import pandas as pd
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import AutoTokenizer
 from peft import LoraConfig, prepare_model_for_kbit_training, get_peft_model
-import os, torch
-from datasets import load_dataset
+import os, torch, functools, time, shutil, hashlib
+from datasets import load_dataset, load_from_disk, Dataset
+from huggingface_hub import HfApi
 from trl import SFTTrainer, DataCollatorForCompletionOnlyLM, SFTConfig
+import trl, transformers
+import split_store
+from model_registry import ModelRegistry
+import batching
+import generation
+
+MOSAIC_DATASET = "mosaicml/instruct-v3"
+MOSAIC_CACHE_PATH = 'data'
+MOSAIC_ARROW_PATH = os.path.join(MOSAIC_CACHE_PATH, 'mosaic_dolly_hhrlhf')
+TOKENIZED_CACHE_PATH = os.path.join('data', 'tokenized')
+
+
+def mosaic_revision():
+    """Commit hash of the current revision of the mosaic dataset, the cached dolly_hhrlhf frame is named after it."""
+    return HfApi().dataset_info(MOSAIC_DATASET).sha
+
+
+def build_mosaic(revision):
+    dataset = load_dataset(MOSAIC_DATASET, revision=revision)
+    dataset = dataset.filter(lambda x: x["source"] == "dolly_hhrlhf")
+    train_mosaic = dataset["train"]
+    train = []
+    for example in train_mosaic:
+        original_system_message = "Below is an instruction that describes a task. Write a response that appropriately completes the request."
+        user_prompt = example['prompt'].replace(original_system_message, "").replace("\n\n### Instruction\n", "").replace("\n### Response\n", "").strip()
+        true_output = example['response']
+        user_prompt = user_prompt.replace('�', ' ').replace('음', ' ')
+        true_output = true_output.replace('�', ' ').replace('음', ' ')
+        if len(user_prompt.split()) + len(true_output.split()) < 1024:
+            train.append((user_prompt.strip(), true_output.strip()))
+    return pd.DataFrame(train, columns=['instruction', 'output'])
+
+
+#The filtered dolly_hhrlhf frame is the same for every fold, it is built once per dataset revision, saved in the data
+#folder and then only read from there
+@functools.lru_cache(maxsize=1)
+def load_mosaic(revision):
+    cache_file = os.path.join(MOSAIC_CACHE_PATH, f'mosaic_whole_long_removed_{revision}.tsv')
+    if os.path.isfile(cache_file):
+        return pd.read_csv(cache_file, encoding='utf8', sep='\t', dtype=str, keep_default_na=False)
+    df_mosaic = build_mosaic(revision)
+    os.makedirs(MOSAIC_CACHE_PATH, exist_ok=True)
+    df_mosaic.to_csv(cache_file + '.tmp', encoding='utf8', sep='\t', index=False)
+    os.replace(cache_file + '.tmp', cache_file)
+    return df_mosaic
+
+
+#Saves the cleaned and filtered dolly_hhrlhf data as an Arrow dataset, it can be copied to machines without network
+#access and read there by load_mosaic_offline
+def materialize_mosaic(path=MOSAIC_ARROW_PATH, revision=None):
+    revision = revision or mosaic_revision()
+    dataset = Dataset.from_pandas(build_mosaic(revision), preserve_index=False)
+    dataset.save_to_disk(path + '.tmp')
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(path + '.tmp', path)
+    print('Saved mosaic data of revision', revision, 'to', path)
+
+
+@functools.lru_cache(maxsize=1)
+def load_mosaic_offline(path=MOSAIC_ARROW_PATH):
+    return load_from_disk(path).to_pandas()
+
 
 #This function concatenates all the train datasets for a specific fold and adds the dolly_hhrlhf data to the train set
 #to prevent model overfitting
-def concat_all(folder_path, adapter_model, shuffle=False, add_data=True):
-    df_all = pd.DataFrame([], columns=['instruction', 'output'])
-    files = os.listdir(folder_path)
+def concat_all(folder_path, adapter_model, shuffle=False, add_data=True, revision=None, mosaic_path=None):
+    frames = [pd.DataFrame([], columns=['instruction', 'output'])]
+    files = [f for f in os.listdir(folder_path) if f.endswith('.tsv')]
     for f in files:
         if '_combined.tsv' not in f:
             path = os.path.join(folder_path, f)
-            df = pd.read_csv(path, encoding='utf8', sep='\t')
-            df_all = pd.concat([df_all, df])
+            frames.append(split_store.read_table(path, columns=['instruction', 'output']))
     print('Data combined')
     if add_data:
-        dataset = load_dataset("mosaicml/instruct-v3")
-        dataset = dataset.filter(lambda x: x["source"] == "dolly_hhrlhf")
-        train_mosaic = dataset["train"]#.select(range(len(df_all)))
-        train = []
-        for example in train_mosaic:
-            original_system_message = "Below is an instruction that describes a task. Write a response that appropriately completes the request."
-            user_prompt = example['prompt'].replace(original_system_message, "").replace("\n\n### Instruction\n", "").replace("\n### Response\n", "").strip()
-            true_output = example['response']
-            user_prompt = user_prompt.replace('�', ' ').replace('음', ' ')
-            true_output = true_output.replace('�', ' ').replace('음', ' ')
-            if len(user_prompt.split()) + len(true_output.split()) < 1024:
-                train.append((user_prompt.strip(), true_output.strip()))
-        df_mosaic = pd.DataFrame(train, columns=['instruction', 'output'])
-        df_mosaic.to_csv('data/mosaic_whole_long_removed.tsv', encoding='utf8', sep='\t', index=False)
-        df_all = pd.concat([df_all, df_mosaic])
+        if mosaic_path is not None:
+            frames.append(load_mosaic_offline(mosaic_path))
+        else:
+            frames.append(load_mosaic(revision or mosaic_revision()))
         print('Added mosaic data')
+    # one concatenation of all frames instead of copying the growing frame for every file
+    df_all = pd.concat(frames)
     if shuffle:
         df_all = df_all.sample(frac=1, random_state=123).reset_index(drop=True)
     df_all.to_csv(os.path.join(folder_path, adapter_model) + '_combined.tsv', encoding='utf8', index=False, sep='\t')
 
 
+#The tokenized train set of a fold is saved under the hash of everything its input_ids depend on: the combined file,
+#the tokenizer (name, vocabulary size and chat template), the maximum sequence length and the trl and transformers
+#versions, so reruns with the same data and tokenizer only memory-map it from disk
+def tokenized_cache_path(train_path, fold, tokenizer, max_seq_length):
+    digest = hashlib.sha256()
+    with open(train_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 24), b''):
+            digest.update(chunk)
+    digest.update(f'{tokenizer.name_or_path}\t{len(tokenizer)}\t{tokenizer.chat_template}\t{max_seq_length}\t'
+                  f'{trl.__version__}\t{transformers.__version__}'.encode('utf8'))
+    name = os.path.basename(train_path).replace('_combined.tsv', '')
+    return os.path.join(TOKENIZED_CACHE_PATH, f'{name}_{fold}_{digest.hexdigest()[:16]}')
+
+
+#Tokenizes the text column the way SFTTrainer does (special tokens added, truncated to max_seq_length), SFTTrainer
+#uses datasets with input_ids as they are
+def tokenize_train_set(dataset, tokenizer, max_seq_length):
+    def tokenize(rows):
+        outputs = tokenizer(rows['text'], add_special_tokens=True, truncation=True, padding=False,
+                            max_length=max_seq_length)
+        return {'input_ids': outputs['input_ids'], 'attention_mask': outputs['attention_mask']}
+
+    return dataset.map(tokenize, batched=True, remove_columns=dataset.column_names, num_proc=4)
+
+
 if __name__ == '__main__':
     #change the paths to data if needed
     TRAIN_SET_PATH = 'train_sets_all_data'
@@ -50,28 +129,32 @@ if __name__ == '__main__':
     adapter_model = "foodyLLM-Meta-LLama-3-8B-Instruct"
     folds = ['split_0', 'split_1', 'split_2', 'split_3', 'split_4']
     test_batch = 16
+    # the base model is loaded (and prepared for k-bit training) once, the adapter of each fold is loaded on top of it
+    registry = ModelRegistry(prepare=None if load_adapter else prepare_model_for_kbit_training)
+    # setting this to True reads the mosaic data from the Arrow dataset in MOSAIC_ARROW_PATH instead of the hub, so
+    # training also starts without network access. The dataset is created here if it does not exist yet, or on a
+    # machine with network access by materialize_mosaic() and copied over
+    offline_mosaic = False
+    if offline_mosaic:
+        if not os.path.isdir(MOSAIC_ARROW_PATH):
+            materialize_mosaic()
+        revision, mosaic_path = None, MOSAIC_ARROW_PATH
+    else:
+        # the mosaic data of this revision is added to every fold
+        revision, mosaic_path = mosaic_revision(), None
     for fold in folds:
         # Loading a dataset
         print('Fold: ', fold)
+        fold_start = time.perf_counter()
         train_folder = os.path.join(TRAIN_SET_PATH, fold)
         test_folder = os.path.join(TEST_SET_PATH, fold)
-        concat_all(train_folder, adapter_model, shuffle=True, add_data=True)
+        start = time.perf_counter()
+        concat_all(train_folder, adapter_model, shuffle=True, add_data=True, revision=revision, mosaic_path=mosaic_path)
+        print(f'Combined the train data of {fold} in {time.perf_counter() - start:.2f} s')
         train_path = os.path.join(train_folder, adapter_model) + '_combined.tsv'
 
-        # Load base model(Mistral 7B)
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.float16,
-            bnb_4bit_use_double_quant=True,
-        )
-
-        model = AutoModelForCausalLM.from_pretrained(
-            base_model,
-            quantization_config=bnb_config,
-            device_map={"": 0},
-            attn_implementation="eager"
-        )
+        # Load base model(Mistral 7B), with the trained adapter of the fold when only testing
+        model = registry.model(base_model, "models/" + adapter_model + '_' + fold if load_adapter else None)
 
         tokenizer = AutoTokenizer.from_pretrained(base_model, trust_remote_code=True)
 
@@ -79,27 +162,31 @@ if __name__ == '__main__':
         tokenizer.pad_token = '<|pad|>'
         tokenizer.pad_token_id = 128255
 
-        # Importing the dataset
-        dataset = load_dataset("csv", sep='\t', data_files={"train": train_path})
+        # Importing the dataset, tokenized once and then read from the cache on later runs
+        max_seq_length = 1024
+        cache_path = tokenized_cache_path(train_path, fold, tokenizer, max_seq_length)
+        if not os.path.isdir(cache_path):
+            dataset = load_dataset("csv", sep='\t', data_files={"train": train_path})
 
-        def format_chat_template(row):
-            row_json = [{"role": "user", "content": row["instruction"]},
-                        {"role": "assistant", "content": row["output"]}]
-            row["text"] = tokenizer.apply_chat_template(row_json, tokenize=False)
-            row["text"] = row['text'].replace('</div>', '').strip()
-            return row
+            def format_chat_template(row):
+                row_json = [{"role": "user", "content": row["instruction"]},
+                            {"role": "assistant", "content": row["output"]}]
+                row["text"] = tokenizer.apply_chat_template(row_json, tokenize=False)
+                row["text"] = row['text'].replace('</div>', '').strip()
+                return row
 
-        dataset = dataset.map(
-            format_chat_template,
-            num_proc=4,
-        )
+            dataset = dataset.map(
+                format_chat_template,
+                num_proc=4,
+            )
+            tokenize_train_set(dataset["train"], tokenizer, max_seq_length).save_to_disk(cache_path + '.tmp')
+            os.replace(cache_path + '.tmp', cache_path)
+        # memory-mapped from the Arrow files of the cache
+        train_dataset = load_from_disk(cache_path)
 
-        if load_adapter:
-            model.load_adapter("models/" + adapter_model + '_' + fold)
-        else:
+        if not load_adapter:
             model.config.use_cache = False  # silence the warnings. Please re-enable for inference!
             model.config.pretraining_tp = 1
-            model = prepare_model_for_kbit_training(model)
             # LoRA config
             peft_config = LoraConfig(
                 r=16,
@@ -118,7 +205,7 @@ if __name__ == '__main__':
                 num_train_epochs=1,
                 per_device_train_batch_size=10,
                 gradient_accumulation_steps=2,
-                max_seq_length=1024,
+                max_seq_length=max_seq_length,
                 optim="paged_adamw_8bit",
                 save_steps=5000,
                 logging_steps=30,
@@ -135,13 +222,14 @@ if __name__ == '__main__':
 
             trainer = SFTTrainer(
                 model,
-                train_dataset=dataset["train"],
+                train_dataset=train_dataset,
                 peft_config=peft_config,
                 tokenizer=tokenizer,
                 args=training_arguments,
                 packing=False,
             )
 
+            print(f'Fold startup of {fold}: {time.perf_counter() - fold_start:.2f} s')
             trainer.train()
             # Save the fine-tuned model
             trainer.model.save_pretrained("models/" + adapter_model + '_' + fold)
@@ -150,69 +238,89 @@ if __name__ == '__main__':
 
         model.config.use_cache = True
         model.eval()
-        all_datasets = os.listdir(test_folder)
+        # the Parquet copies are read through their TSV names
+        all_datasets = [f for f in os.listdir(test_folder) if f.endswith('.tsv')]
+        # the longest answers of every task in the train sets of the fold cap the generated tokens
+        train_tables = [split_store.read_table(os.path.join(train_folder, f)) for f in os.listdir(train_folder)
+                        if f.endswith('.tsv') and '_combined.tsv' not in f]
+        task_tokens = generation.task_max_new_tokens(tokenizer, train_tables)
 
         #Test the model on each dataset in the test fold
         for td in all_datasets:
             all_data = []
             if '_combined.tsv' not in td:
                 print('Testing on ', td)
-                if 'ner' not in td:
-                    current_batch = test_batch
-                else:
-                    current_batch = 1
-                df = pd.read_csv(os.path.join(test_folder, td), encoding='utf8', sep='\t')
-                prev_answer = ""
-                for i in range(0, len(df), current_batch):
-                    if i % (current_batch * 10) == 0:
-                        print('Generating example', i)
-                    examples = df[i:i + current_batch]
-                    tokenizer_input = []
-                    true_outputs = []
-                    for true_output in examples['output']:
-                        true_outputs.append(true_output)
-                    original_prompts = []
-                    true_prompts = []
-                    for user_prompt in examples['instruction']:
-                        original_prompts.append(user_prompt)
-                        system_prompt = ''
-                        get_answer = False
-                        if not '</div>' in user_prompt:
-                            messages = [
-                                {
-                                    "role": "user",
-                                    "content": f"{system_prompt} {user_prompt}".strip()
-                                }
-                            ]
-                            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                            get_answer = True
-                        else:
-                            _, question = user_prompt.split("</div>")
-                            messages = [
-                                {
-                                    "role": "user",
-                                    "content": f"{prev_answer.strip()} {question.strip()}".strip()
-                                }
-                            ]
-                            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-                        tokenizer_input.append(prompt)
-
-                    inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
-                    generated_ids = model.generate(**inputs, max_new_tokens=1024, do_sample=True)
-                    answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
-                    answers = [(" ".join((x.split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0]
-                                .replace("<|start_header_id|>assistant", '').replace("<|end_header_id|>", '')
-                                         .replace("<|start_header_id|>", '').split())).strip() for x in answers]
-                    if get_answer:
-                        prev_answer = answers[0]
-                    tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
-                    original_prompts = [x.strip() for x in original_prompts]
-                    batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
-                    all_data.extend(batched_examples)
+                current_batch = test_batch
+                df = split_store.read_table(os.path.join(test_folder, td))
+                generate_kwargs = generation.generate_kwargs(tokenizer, model.generation_config,
+                                                             task_tokens.get(generation.task_of(df), generation.MAX_NEW_TOKENS))
+                print('max_new_tokens', generate_kwargs['max_new_tokens'])
+                # the prompt a row is generated from, with the answer of the first turn it continues
+                def format_prompt(user_prompt, prev_answer):
+                    system_prompt = ''
+                    if not '</div>' in user_prompt:
+                        messages = [
+                            {
+                                "role": "user",
+                                "content": f"{system_prompt} {user_prompt}".strip()
+                            }
+                        ]
+                        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                    else:
+                        _, question = user_prompt.split("</div>")
+                        messages = [
+                            {
+                                "role": "user",
+                                "content": f"{prev_answer.strip()} {question.strip()}".strip()
+                            }
+                        ]
+                        prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+                    return prompt
+
+                # the first turns of all documents are generated in one wave and the turns continuing their answers (</div>)
+                # in a second one. The prompts of a wave are built before batching, so the rows are sorted by the token length
+                # of the prompt they are generated from and batched under a token budget with the same worst case as
+                # 1024 token prompts in batches of current_batch
+                parents = batching.chain_parents(df['instruction'].tolist())
+                batches = []
+                answers_by_row = {}
+                throughput = batching.Throughput()
+                for wave in batching.dependency_waves(parents):
+                    prompts = {row: format_prompt(df['instruction'].iloc[row], answers_by_row.get(parents[row], "")) for row in wave}
+                    lengths = batching.token_lengths(tokenizer, [prompts[row] for row in wave], max_length=1024)
+                    wave_batches = batching.wave_batches(wave, lengths, current_batch * (1024 + 1024), reserved=generate_kwargs['max_new_tokens'],
+                                                         max_rows=2 * current_batch)
+                    batches += wave_batches
+                    for n, batch in enumerate(wave_batches):
+                        if n % 10 == 0:
+                            print('Generating batch', n, 'of', len(wave_batches))
+                        examples = df.iloc[batch]
+                        tokenizer_input = [prompts[row] for row in batch]
+                        true_outputs = examples['output'].tolist()
+                        original_prompts = examples['instruction'].tolist()
+
+                        inputs = tokenizer(tokenizer_input, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(device)
+                        generated_ids = model.generate(**inputs, do_sample=True, **generate_kwargs)
+                        throughput.add(generated_ids, inputs['input_ids'].shape[1], generate_kwargs['eos_token_id'])
+                        answers = tokenizer.batch_decode(generated_ids[:, inputs['input_ids'].shape[1]:])
+                        answers = [(" ".join((x.split('<|end_of_text|>')[0].split('<|im_end|>')[0]).split('<|eot_id|>')[0]
+                                    .replace("<|start_header_id|>assistant", '').replace("<|end_header_id|>", '')
+                                             .replace("<|start_header_id|>", '').split())).strip() for x in answers]
+                        answers_by_row.update(zip(batch, answers))
+                        tokenizer_input = [" ".join(x.strip().split()) for x in tokenizer_input]
+                        original_prompts = [x.strip() for x in original_prompts]
+                        batched_examples = zip(original_prompts, tokenizer_input, answers, true_outputs)
+                        all_data.extend(batched_examples)
 
+                # back to the order of the test set
+                all_data = batching.restore_order(batches, all_data)
+                throughput.report(td)
                 df = pd.DataFrame(all_data, columns=['Original prompt', 'True prompt', 'Answer', 'True'])
                 results_output = "results/" + adapter_model + '/' + td.split('.')[0] + '_' + fold + ".tsv"
                 df.to_csv(results_output, encoding='utf8', sep='\t', index=False)
+        if not load_adapter:
+            # remove the LoRA layers trained in this fold, the base model is reused by the next one
+            registry.release(base_model, model)
         del model
         del tokenizer
 